@@ -0,0 +1,393 @@
+"""Замеры производительности модуля фитнес-трекера."""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from operator import methodcaller
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import homework
+
+# Диапазоны полей синтетических пакетов: целые границы дают int,
+# дробные — float.
+PACKET_RANGES: Dict[str, List[Tuple[float, float]]] = {
+    'SWM': [(100, 5000), (0.25, 3.0), (40, 120), (25, 50), (10, 80)],
+    'RUN': [(1000, 30000), (0.25, 3.0), (40, 120)],
+    'WLK': [(1000, 30000), (0.25, 3.0), (40, 120), (140, 210)],
+}
+CHUNK_SIZE = 10_000
+LATENCY_SAMPLES = 10_000
+PERCENTILES = (50, 90, 99)
+
+
+def _allocated(build: Callable[[], object]) -> int:
+    """Сколько байт заняло в куче то, что вернула `build`."""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = build()
+        allocated = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del result
+    return allocated
+
+
+def measure_memory(records: int) -> Dict[str, float]:
+    """Сравнить память объектов и колоночного хранилища на миллион записей.
+
+    Возвращает байты на миллион записей для списка объектов `Running`,
+    `TrainingStore` и списка `InfoMessage`.
+    """
+    data = [(15000 + i, 1, 75) for i in range(records)]
+
+    def objects() -> List[homework.Training]:
+        return [homework.Running(*row) for row in data]
+
+    def store() -> homework.TrainingStore:
+        training_store = homework.TrainingStore('RUN')
+        training_store.extend(data)
+        return training_store
+
+    def messages() -> List[homework.InfoMessage]:
+        return [homework.InfoMessage('Running', float(i), 1.0, 1.0, 1.0)
+                for i in range(records)]
+
+    scale = 1_000_000 / records
+    return {
+        'training_objects': _allocated(objects) * scale,
+        'training_store': _allocated(store) * scale,
+        'info_messages': _allocated(messages) * scale,
+    }
+
+
+def measure_rendering(records: int) -> Dict[str, float]:
+    """Сравнить скорость вывода: сообщений в секунду для каждого способа."""
+    data = {
+        'action': [15000 + i for i in range(records)],
+        'duration': [1 + i % 3 for i in range(records)],
+        'weight': [75] * records,
+    }
+    batch = homework.compute_batch('RUN', data)
+    messages = [homework.InfoMessage(batch.training_type, *row)
+                for row in zip(batch.duration, batch.distance,
+                               batch.speed, batch.calories)]
+
+    def get_message() -> None:
+        output = io.StringIO()
+        for info in messages:
+            output.write(info.get_message() + '\n')
+
+    def write_messages() -> None:
+        homework.write_messages(messages, io.StringIO())
+
+    def write_batch() -> None:
+        homework.write_batch(batch, io.StringIO())
+
+    result = {}
+    for name, render in [('get_message', get_message),
+                         ('write_messages', write_messages),
+                         ('write_batch', write_batch)]:
+        start = time.perf_counter()
+        render()
+        result[name] = records / (time.perf_counter() - start)
+    return result
+
+
+def measure_metrics(records: int) -> Dict[str, float]:
+    """Сравнить расчёт метрик: тренировок в секунду, вместе с созданием.
+
+    `getters` вызывает `get_distance`, `get_mean_speed` и
+    `get_spent_calories` по отдельности, и каждая следующая формула
+    пересчитывает предыдущие. `show_training_info` считает дистанцию
+    и скорость один раз и передаёт их дальше.
+    """
+    packets = [packet for workout_type in PACKET_RANGES
+               for packet in generate_packets(workout_type,
+                                              records // len(PACKET_RANGES))]
+
+    def getters() -> None:
+        for packet in packets:
+            training = homework.read_package(*packet)
+            training.get_distance()
+            training.get_mean_speed()
+            training.get_spent_calories()
+
+    def show_training_info() -> None:
+        for packet in packets:
+            homework.read_package(*packet).show_training_info()
+
+    result = {}
+    for name, calculate in [('getters', getters),
+                            ('show_training_info', show_training_info)]:
+        start = time.perf_counter()
+        calculate()
+        result[name] = len(packets) / (time.perf_counter() - start)
+    return result
+
+
+def measure_sensor(samples: int, athletes: int = 100) -> Dict[str, float]:
+    """Замерить разбор потоков датчиков: отсчётов в секунду.
+
+    Отсчёты `athletes` спортсменов идут вперемешку, каждый пятый
+    отсчёт запрашивает метрики скользящего окна.
+    """
+    rng = random.Random('sensor')
+    streams = [homework.SensorStream('RUN', {'weight': 75}, lap=0.4)
+               for _ in range(athletes)]
+    times = [0.0] * athletes
+    schedule = [rng.randrange(athletes) for _ in range(samples)]
+    segments = 0
+    start = time.perf_counter()
+    for index, athlete in enumerate(schedule):
+        times[athlete] += 0.3
+        segments += len(streams[athlete].add(times[athlete], 1))
+        if index % 5 == 0:
+            streams[athlete].current()
+    elapsed = time.perf_counter() - start
+    return {'samples_per_second': samples / elapsed, 'laps': segments}
+
+
+def measure_threads(records: int,
+                    max_threads: int,
+                    repeat: int = 3
+                    ) -> Dict[str, Any]:
+    """Замерить пакетный расчёт `BatchExecutor` на 1..`max_threads` потоках.
+
+    Для каждого числа потоков берётся лучший из `repeat` прогонов,
+    в записях в секунду. `gil` — включён ли GIL в этой сборке.
+    """
+    rng = random.Random('threads')
+    arrays = {
+        'action': [rng.randint(1000, 30000) for _ in range(records)],
+        'duration': [rng.uniform(0.25, 3.0) for _ in range(records)],
+        'weight': [rng.uniform(40, 120) for _ in range(records)],
+        'height': [rng.uniform(140, 210) for _ in range(records)],
+    }
+    numpy = homework._load_numpy()
+    if numpy is not None:
+        arrays = {name: numpy.asarray(column, dtype=float)
+                  for name, column in arrays.items()}
+    result = {}
+    for threads in range(1, max_threads + 1):
+        chunk_size = max(1, -(-records // threads))
+        with homework.BatchExecutor(threads, chunk_size) as executor:
+            best = float('inf')
+            for _ in range(repeat):
+                start = time.perf_counter()
+                executor.compute('WLK', arrays)
+                best = min(best, time.perf_counter() - start)
+        result[str(threads)] = records / best
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', None)
+    return {'gil': is_gil_enabled() if is_gil_enabled else True,
+            'numpy': numpy is not None,
+            'records_per_second': result}
+
+
+def generate_packets(workout_type: str,
+                     count: int,
+                     seed: int = 0
+                     ) -> Iterator[Tuple[str, List[float]]]:
+    """Выдать `count` воспроизводимых пакетов данного вида."""
+    rng = random.Random('%s:%d' % (workout_type, seed))
+    ranges = PACKET_RANGES[workout_type]
+    for _ in range(count):
+        yield workout_type, [
+            rng.randint(low, high) if isinstance(low, int)
+            else round(rng.uniform(low, high), 3)
+            for low, high in ranges
+        ]
+
+
+def _trainings(packets: List[tuple]) -> List[homework.Training]:
+    return [homework.read_package(*packet) for packet in packets]
+
+
+def _messages(packets: List[tuple]) -> List[homework.InfoMessage]:
+    return [training.show_training_info()
+            for training in _trainings(packets)]
+
+
+# Этап: как подготовить входы из пакетов и что замерять на каждом входе.
+# Подготовка входов в замер не входит: время идёт только на операцию.
+STAGES: Dict[str, Tuple[Callable[[List[tuple]], list],
+                        Callable[[Any], object]]] = {
+    'read_package': (list, lambda packet: homework.read_package(*packet)),
+    'get_distance': (_trainings, methodcaller('get_distance')),
+    'get_mean_speed': (_trainings, methodcaller('get_mean_speed')),
+    'get_spent_calories': (_trainings, methodcaller('get_spent_calories')),
+    'show_training_info': (_trainings, methodcaller('show_training_info')),
+    'get_message': (_messages, methodcaller('get_message')),
+    'main': (_trainings, homework.main),
+}
+
+
+def _percentile(ordered: List[int], percent: int) -> float:
+    """Процентиль отсортированных задержек в микросекундах, 0 без них."""
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, len(ordered) * percent // 100)
+    return ordered[index] / 1000
+
+
+def measure_stage(stage: str,
+                  workout_type: str,
+                  count: int
+                  ) -> Dict[str, float]:
+    """Замерить пропускную способность и задержки одного этапа.
+
+    Пакеты генерируются кусками по `CHUNK_SIZE`, поэтому память не
+    растёт с `count`. Задержки снимаются поштучно на первых
+    `LATENCY_SAMPLES` входах, отдельно от общего замера.
+    """
+    prepare, operation = STAGES[stage]
+    elapsed = 0.0
+    latencies: List[int] = []
+    for chunk in homework.chunked(generate_packets(workout_type, count),
+                                  CHUNK_SIZE):
+        items = prepare(chunk)
+        start = time.perf_counter()
+        for item in items:
+            operation(item)
+        elapsed += time.perf_counter() - start
+        for item in prepare(chunk[:LATENCY_SAMPLES - len(latencies)]):
+            start_ns = time.perf_counter_ns()
+            operation(item)
+            latencies.append(time.perf_counter_ns() - start_ns)
+    latencies.sort()
+    result = {'throughput': count / elapsed if elapsed else 0.0}
+    for percent in PERCENTILES:
+        result['p%d_us' % percent] = _percentile(latencies, percent)
+    return result
+
+
+def run_suite(counts: List[int],
+              workout_types: List[str]
+              ) -> Dict[str, Any]:
+    """Прогнать все этапы для каждого вида тренировки и объёма."""
+    results: Dict[str, Dict[str, Dict[str, Dict[str, float]]]] = {}
+    with open(os.devnull, 'w', encoding='utf-8') as devnull, \
+            redirect_stdout(devnull):
+        for count in counts:
+            results[str(count)] = {
+                workout_type: {stage: measure_stage(stage, workout_type,
+                                                    count)
+                               for stage in STAGES}
+                for workout_type in workout_types
+            }
+    return {'python': platform.python_version(), 'results': results}
+
+
+def compare(report: Dict[str, Any],
+            baseline: Dict[str, Any],
+            tolerance: float = 0.2
+            ) -> List[str]:
+    """Найти этапы, которые стали медленнее базового отчёта.
+
+    Регрессия — пропускная способность ниже базовой или медиана
+    задержки выше базовой больше чем на `tolerance`.
+    """
+    regressions = []
+    for count, types in baseline['results'].items():
+        for workout_type, stages in types.items():
+            for stage, base in stages.items():
+                current = (report['results'].get(count, {})
+                           .get(workout_type, {}).get(stage))
+                if current is None:
+                    continue
+                name = '%s/%s/%s' % (count, workout_type, stage)
+                if current['throughput'] < base['throughput'] * (
+                        1 - tolerance):
+                    regressions.append('%s: throughput %.0f < %.0f'
+                                       % (name, current['throughput'],
+                                          base['throughput']))
+                if current['p50_us'] > base['p50_us'] * (1 + tolerance):
+                    regressions.append('%s: p50 %.3f мкс > %.3f мкс'
+                                       % (name, current['p50_us'],
+                                          base['p50_us']))
+    return regressions
+
+
+def measure_startup(module: str) -> Dict[str, Any]:
+    """Замерить импорт модуля в свежем интерпретаторе через -X importtime.
+
+    Возвращает общее время импорта модуля и накопленное время каждого
+    подтянутого им модуля, в микросекундах.
+    """
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True, check=True)
+    modules: Dict[str, int] = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = int(cumulative)
+    return {'total_us': modules[module], 'modules': modules}
+
+
+def run(argv: Optional[List[str]] = None) -> None:
+    """Запустить замеры из командной строки."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--packets', type=int, nargs='+', default=[1000],
+                        help='объёмы прогона, например 1000 1000000 '
+                             '10000000')
+    parser.add_argument('--types', nargs='+', default=list(PACKET_RANGES),
+                        choices=list(PACKET_RANGES),
+                        help='виды тренировок')
+    parser.add_argument('--records', type=int, default=0,
+                        help='добавить замеры памяти и вывода '
+                             'на этом числе записей')
+    parser.add_argument('--sensor', type=int, default=0,
+                        help='добавить замер разбора отсчётов датчиков '
+                             'на этом числе отсчётов')
+    parser.add_argument('--threads', type=int, default=0,
+                        help='добавить замер пакетного расчёта на 1..N '
+                             'потоках на --records записях')
+    parser.add_argument('--startup', action='store_true',
+                        help='добавить замер импорта homework и '
+                             'homework_client')
+    parser.add_argument('--output', help='файл для JSON-отчёта')
+    parser.add_argument('--baseline', help='базовый JSON-отчёт')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='допустимое ухудшение относительно базы')
+    args = parser.parse_args(argv)
+    report = run_suite(args.packets, args.types)
+    if args.records:
+        report['memory'] = measure_memory(args.records)
+        report['rendering'] = measure_rendering(args.records)
+        report['metrics'] = measure_metrics(args.records)
+    if args.threads:
+        report['threads'] = measure_threads(args.records or 1_000_000,
+                                            args.threads)
+    if args.sensor:
+        report['sensor'] = measure_sensor(args.sensor)
+    if args.startup:
+        report['startup'] = {
+            module: measure_startup(module)['total_us']
+            for module in ('homework', 'homework_client')
+        }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(text + '\n')
+    else:
+        print(text)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            regressions = compare(report, json.load(file), args.tolerance)
+        if regressions:
+            sys.exit('Регрессии производительности:\n'
+                     + '\n'.join(regressions))
+
+
+if __name__ == '__main__':
+    run()
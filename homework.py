@@ -1,5 +1,44 @@
-from typing import List, Type, Dict
-from dataclasses import dataclass, asdict
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+from functools import partial, wraps
+from itertools import count, islice
+from operator import attrgetter
+from typing import (TYPE_CHECKING, AsyncIterator, BinaryIO, Callable,
+                    ContextManager, Dict, Hashable, Iterable, Iterator, List,
+                    Optional, Sequence, TextIO, Tuple, Type, Union)
+from dataclasses import dataclass, asdict, field
+
+# Тяжёлые модули импортируются там, где нужны, чтобы короткие запуски
+# не платили за режимы, которыми не пользуются.
+if TYPE_CHECKING:
+    import argparse
+    import asyncio
+    import queue
+    from concurrent.futures import Future
+
+# NumPy загружается при первом пакетном расчёте, см. `_load_numpy`.
+_NOT_LOADED = object()
+np = _NOT_LOADED
+
+
+def _load_numpy():
+    """Вернуть модуль NumPy или None, если он не установлен."""
+    global np
+    if np is _NOT_LOADED:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        np = numpy
+    return np
 
 
 @dataclass
@@ -10,11 +49,19 @@ class InfoMessage:
     distance: float
     speed: float
     calories: float
+    __slots__ = ('training_type', 'duration', 'distance', 'speed', 'calories')
     MESSAGE = ('Тип тренировки: {training_type}; '
                'Длительность: {duration:0.3f} ч.; '
                'Дистанция: {distance:0.3f} км; '
                'Ср. скорость: {speed:0.3f} км/ч; '
                'Потрачено ккал: {calories:0.3f}.')
+    # То же, что MESSAGE, но для %-форматирования без asdict(): так
+    # строки собираются в пакетной записи.
+    LINE = ('Тип тренировки: %s; '
+            'Длительность: %.3f ч.; '
+            'Дистанция: %.3f км; '
+            'Ср. скорость: %.3f км/ч; '
+            'Потрачено ккал: %.3f.\n')
 
     def get_message(self) -> str:
         return self.MESSAGE.format(**asdict(self))
@@ -25,6 +72,15 @@ class Training:
     LEN_STEP = 0.65
     M_IN_KM = 1000
     HOUR_IN_MIN = 60
+    FIELDS: Tuple[str, ...] = ('action', 'duration', 'weight')
+    # Поля, на которые делят формулы: они должны быть больше нуля.
+    NONZERO_FIELDS: Tuple[str, ...] = ('duration',)
+    # Переопределены ли в классе сами get_*-методы. Тогда
+    # show_training_info вызывает их, а не формулы `mean_speed`
+    # и `spent_calories` с уже посчитанными значениями. Так же он
+    # поступает, если у объекта есть атрибуты сверх `FIELDS`: среди
+    # них может быть подменённый get_*-метод.
+    _custom_getters = True
 
     def __init__(self,
                  action: int,
@@ -35,6 +91,15 @@ class Training:
         self.duration = duration
         self.weight = weight
 
+    def __init_subclass__(cls, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+        cls._custom_getters = (
+            cls.get_distance is not Training.get_distance
+            or cls.get_mean_speed is not Training.get_mean_speed
+            or cls.get_spent_calories is not Training.get_spent_calories
+            or cls.spent_calories is Training.spent_calories
+        )
+
     def get_distance(self) -> float:
         """Получить дистанцию в км."""
         distance: float = self.action * self.LEN_STEP / self.M_IN_KM
@@ -42,21 +107,42 @@ class Training:
 
     def get_mean_speed(self) -> float:
         """Получить среднюю скорость движения."""
-        speed: float = (self.get_distance() / self.duration)
-        return speed
+        return self.mean_speed(self.get_distance())
 
     def get_spent_calories(self) -> float:
         """Получить количество затраченных калорий."""
+        return self.spent_calories(self.get_mean_speed())
+
+    def mean_speed(self, distance: float) -> float:
+        """Средняя скорость по уже посчитанной дистанции."""
+        speed: float = distance / self.duration
+        return speed
+
+    def spent_calories(self, speed: float) -> float:
+        """Калории по уже посчитанной средней скорости."""
         raise NotImplementedError('Определите get_spent_calories в %s.'
                                   % (type(self).__name__))
 
     def show_training_info(self) -> InfoMessage:
-        """Вернуть информационное сообщение о выполненной тренировке."""
+        """Вернуть информационное сообщение о выполненной тренировке.
+
+        Дистанция и скорость считаются по одному разу и передаются
+        в следующие формулы.
+        """
+        if self._custom_getters or len(vars(self)) > len(self.FIELDS):
+            return InfoMessage(type(self).__name__,
+                               self.duration,
+                               self.get_distance(),
+                               self.get_mean_speed(),
+                               self.get_spent_calories()
+                               )
+        distance = self.get_distance()
+        speed = self.mean_speed(distance)
         return InfoMessage(type(self).__name__,
                            self.duration,
-                           self.get_distance(),
-                           self.get_mean_speed(),
-                           self.get_spent_calories()
+                           distance,
+                           speed,
+                           self.spent_calories(speed)
                            )
 
 
@@ -65,10 +151,10 @@ class Running(Training):
     coeff_cal_run1: int = 18
     coeff_cal_run2: int = 20
 
-    def get_spent_calories(self) -> float:
+    def spent_calories(self, speed: float) -> float:
         """Получить количество затраченных калорий."""
         duration_minute: float = self.duration * self.HOUR_IN_MIN
-        calories: float = ((self.coeff_cal_run1 * self.get_mean_speed()
+        calories: float = ((self.coeff_cal_run1 * speed
                            - self.coeff_cal_run2) * self.weight
                            / self.M_IN_KM * duration_minute)
         return calories
@@ -78,6 +164,8 @@ class SportsWalking(Training):
     """Тренировка: спортивная ходьба."""
     coeff_cal_walk_1: float = 0.035
     coeff_cal_walk_2: float = 0.029
+    FIELDS: Tuple[str, ...] = Training.FIELDS + ('height',)
+    NONZERO_FIELDS: Tuple[str, ...] = Training.NONZERO_FIELDS + ('height',)
 
     def __init__(self,
                  action: int,
@@ -88,11 +176,11 @@ class SportsWalking(Training):
         super().__init__(action, duration, weight)
         self.height = height
 
-    def get_spent_calories(self) -> float:
+    def spent_calories(self, speed: float) -> float:
         """Получить количество затраченных калорий."""
         duration_minute: float = self.duration * self.HOUR_IN_MIN
         calories: float = (self.coeff_cal_walk_1 * self.weight
-                           + (self.get_mean_speed()**2 // self.height)
+                           + (speed**2 // self.height)
                            * self.coeff_cal_walk_2
                            * self.weight) * duration_minute
         return calories
@@ -103,6 +191,7 @@ class Swimming(Training):
     LEN_STEP = 1.38
     coeff_cal_swim_1: float = 1.1
     coeff_cal_swim_2: int = 2
+    FIELDS: Tuple[str, ...] = Training.FIELDS + ('length_pool', 'count_pool')
 
     def __init__(self,
                  action: int,
@@ -115,53 +204,2711 @@ class Swimming(Training):
         self.length_pool = length_pool
         self.count_pool = count_pool
 
-    def get_mean_speed(self) -> float:
-        """Получить среднюю скорость движения."""
+    def mean_speed(self, distance: float) -> float:
+        """Получить среднюю скорость движения по бассейнам."""
         speed: float = (self.length_pool * self.count_pool
                         / self.M_IN_KM / self.duration)
         return speed
 
-    def get_distance(self) -> float:
-        """Получить дистанцию в км."""
-        distance: float = self.action * self.LEN_STEP / self.M_IN_KM
-        return distance
-
-    def get_spent_calories(self) -> float:
+    def spent_calories(self, speed: float) -> float:
         """Получить количество затраченных калорий."""
-        spent_calories_swim: float = ((self.get_mean_speed()
-                                      + self.coeff_cal_swim_1)
+        spent_calories_swim: float = ((speed + self.coeff_cal_swim_1)
                                       * self.coeff_cal_swim_2
                                       * self.weight)
         return spent_calories_swim
 
 
+TRAINING_TYPES: Dict[str, Type[Training]] = {}
+# Конструкторы с проверкой числа полей, по коду вида тренировки.
+_constructors: Dict[str, Callable[[Sequence[float]], Training]] = {}
+
+
+def _make_constructor(training_class: Type[Training]
+                      ) -> Callable[[Sequence[float]], Training]:
+    """Собрать конструктор, проверяющий число полей пакета."""
+    arity = len(training_class.FIELDS)
+    name = training_class.__name__
+
+    def construct(data: Sequence[float]) -> Training:
+        if len(data) != arity:
+            raise TypeError('%s ожидает %d значений, получено %d.'
+                            % (name, arity, len(data)))
+        return training_class(*data)
+    return construct
+
+
+def register_training(workout_type: str,
+                      training_class: Optional[Type[Training]] = None):
+    """Зарегистрировать вид тренировки под трёхбуквенным кодом.
+
+    Можно вызвать напрямую или использовать как декоратор класса:
+    `@register_training('SQT')`. `FIELDS` класса должны совпадать
+    с параметрами его конструктора.
+    """
+    if training_class is None:
+        return partial(register_training, workout_type)
+    if not (len(workout_type) == 3 and workout_type.isascii()):
+        raise ValueError('Код тренировки должен состоять из трёх '
+                         'ASCII-символов: %r' % workout_type)
+    if not (isinstance(training_class, type)
+            and issubclass(training_class, Training)):
+        raise TypeError('%r не является подклассом Training.'
+                        % (training_class,))
+    import inspect
+
+    parameters = tuple(inspect.signature(training_class).parameters)
+    if parameters != training_class.FIELDS:
+        raise TypeError('FIELDS класса %s %r не совпадают с параметрами '
+                        'конструктора %r.' % (training_class.__name__,
+                                              training_class.FIELDS,
+                                              parameters))
+    TRAINING_TYPES[workout_type] = training_class
+    _constructors[workout_type] = _make_constructor(training_class)
+    return training_class
+
+
+def unregister_training(workout_type: str) -> None:
+    """Убрать вид тренировки из реестра."""
+    del TRAINING_TYPES[workout_type]
+    del _constructors[workout_type]
+
+
+def get_training_class(workout_type: str) -> Type[Training]:
+    """Вернуть класс тренировки по коду."""
+    try:
+        return TRAINING_TYPES[workout_type]
+    except KeyError:
+        raise ValueError(*TRAINING_TYPES, ' - Доступные типы тренировки')
+
+
+register_training('SWM', Swimming)
+register_training('RUN', Running)
+register_training('WLK', SportsWalking)
+
+
 def read_package(workout_type: str, data: List[int]) -> Training:
     """Прочитать данные полученные от датчиков."""
-    training_type: Dict[str, Type[Training]] = {
-        'SWM': Swimming,
-        'RUN': Running,
-        'WLK': SportsWalking,
+    try:
+        constructor = _constructors[workout_type]
+    except KeyError:
+        raise ValueError(*TRAINING_TYPES, ' - Доступные типы тренировки')
+    return constructor(data)
+
+
+@dataclass
+class TrainingBatch:
+    """Результаты пакетного расчёта тренировок одного вида."""
+    training_type: str
+    duration: Sequence[float]
+    distance: Sequence[float]
+    speed: Sequence[float]
+    calories: Sequence[float]
+
+    def __len__(self) -> int:
+        return len(self.duration)
+
+
+def compute_batch(workout_type: str,
+                  arrays: Dict[str, Sequence[float]]
+                  ) -> TrainingBatch:
+    """Рассчитать дистанцию, скорость и калории для колонок данных.
+
+    Ключи `arrays` совпадают с параметрами конструктора тренировки.
+    С NumPy формулы классов применяются сразу ко всем колонкам:
+    экземпляр создаётся один раз с массивами вместо чисел. Без NumPy
+    расчёт идёт построчно, результаты складываются в `array('d')`.
+    Деление на ноль в обоих случаях, как и у объектов, поднимает
+    ZeroDivisionError, а переполнение — OverflowError, а не даёт inf
+    или nan. С NumPy OverflowError поднимает любое переполнение, даже
+    в умножении, где у чисел Python получилась бы inf.
+    """
+    training_class = get_training_class(workout_type)
+    columns = [arrays[name] for name in training_class.FIELDS]
+    numpy = _load_numpy()
+    if numpy is not None:
+        try:
+            with numpy.errstate(all='raise', under='ignore'):
+                info = training_class(*(
+                    numpy.asarray(column, dtype=float) for column in columns
+                )).show_training_info()
+        except FloatingPointError as error:
+            if 'overflow' in str(error):
+                raise OverflowError(str(error)) from error
+            raise ZeroDivisionError(str(error)) from error
+        return TrainingBatch(info.training_type, info.duration,
+                             info.distance, info.speed, info.calories)
+    distance, speed, calories = array('d'), array('d'), array('d')
+    for row in zip(*columns):
+        info = training_class(*row).show_training_info()
+        distance.append(info.distance)
+        speed.append(info.speed)
+        calories.append(info.calories)
+    return TrainingBatch(training_class.__name__,
+                         array('d', arrays['duration']),
+                         distance,
+                         speed,
+                         calories)
+
+
+def _concatenate(parts: List[Sequence[float]]) -> Sequence[float]:
+    """Склеить куски колонки результата: массивы NumPy или `array('d')`."""
+    if len(parts) == 1:
+        return parts[0]
+    numpy = _load_numpy()
+    if numpy is not None and not isinstance(parts[0], array):
+        return numpy.concatenate(parts)
+    result = array('d')
+    for part in parts:
+        result.extend(part)
+    return result
+
+
+class BatchExecutor:
+    """Пул потоков для пакетного расчёта в одном процессе.
+
+    Колонки режутся на куски не короче `chunk_size`, куски считаются
+    `compute_batch` в потоках пула. С NumPy формулы классов работают
+    ufunc-ами над кусками, а они отпускают GIL, поэтому потоки считают
+    параллельно и на обычном CPython. Пулом можно делиться между
+    потоками вызывающего кода: каждый вызов `compute` независим.
+    """
+
+    def __init__(self,
+                 threads: Optional[int] = None,
+                 chunk_size: int = 65536
+                 ) -> None:
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.threads = threads or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self._pool = ThreadPoolExecutor(self.threads,
+                                        thread_name_prefix='batch')
+
+    def __enter__(self) -> 'BatchExecutor':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def compute(self,
+                workout_type: str,
+                arrays: Dict[str, Sequence[float]]
+                ) -> TrainingBatch:
+        """Рассчитать колонки как `compute_batch`, разбив их по потокам."""
+        training_class = get_training_class(workout_type)
+        size = len(arrays[training_class.FIELDS[0]])
+        pieces = min(self.threads, -(-size // self.chunk_size))
+        if pieces <= 1:
+            return compute_batch(workout_type, arrays)
+        numpy = _load_numpy()
+        if numpy is not None:
+            arrays = {name: numpy.asarray(arrays[name], dtype=float)
+                      for name in training_class.FIELDS}
+        step = -(-size // pieces)
+        batches = list(self._pool.map(
+            lambda start: compute_batch(
+                workout_type,
+                {name: arrays[name][start:start + step]
+                 for name in training_class.FIELDS}),
+            range(0, size, step)))
+        return TrainingBatch(training_class.__name__, *(
+            _concatenate([getattr(batch, name) for batch in batches])
+            for name in ('duration', 'distance', 'speed', 'calories')))
+
+    def map(self,
+            blocks: Iterable[Tuple[str, Dict[str, Sequence[float]]]]
+            ) -> Iterator[TrainingBatch]:
+        """Рассчитать поток блоков колонок по блоку на поток.
+
+        Результаты идут в порядке блоков, в работе одновременно не
+        больше двух блоков на поток.
+        """
+        pending: 'deque[Future]' = deque()
+        for workout_type, arrays in blocks:
+            pending.append(self._pool.submit(compute_batch, workout_type,
+                                             arrays))
+            if len(pending) >= 2 * self.threads:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def close(self) -> None:
+        """Дождаться текущих расчётов и остановить потоки."""
+        self._pool.shutdown()
+
+
+class TrainingStore:
+    """Тренировки одного вида в плоских массивах по колонкам.
+
+    На запись уходит по 8 байт на поле вместо целого объекта
+    `Training`; объекты создаются только при обращении по индексу.
+    """
+
+    def __init__(self, workout_type: str) -> None:
+        self.training_class = get_training_class(workout_type)
+        self.workout_type = workout_type
+        self.columns: Dict[str, array] = {
+            name: array('d') for name in self.training_class.FIELDS
+        }
+
+    def __len__(self) -> int:
+        return len(self.columns['duration'])
+
+    def __getitem__(self, index: int) -> Training:
+        return self.training_class(*(column[index]
+                                     for column in self.columns.values()))
+
+    def __iter__(self) -> Iterator[Training]:
+        for row in zip(*self.columns.values()):
+            yield self.training_class(*row)
+
+    def append(self, data: Sequence[float]) -> None:
+        """Добавить пакет данных датчиков.
+
+        Пакет сначала целиком переводится в числа, поэтому плохое
+        значение не оставляет колонки разной длины.
+        """
+        if len(data) != len(self.columns):
+            raise TypeError('%s ожидает %d значений, получено %d.'
+                            % (self.training_class.__name__,
+                               len(self.columns), len(data)))
+        row = array('d', data)
+        for column, value in zip(self.columns.values(), row):
+            column.append(value)
+
+    def extend(self, packets: Iterable[Sequence[float]]) -> None:
+        """Добавить несколько пакетов данных датчиков."""
+        for data in packets:
+            self.append(data)
+
+    @property
+    def nbytes(self) -> int:
+        """Объём данных в колонках, байт."""
+        return sum(column.itemsize * len(column)
+                   for column in self.columns.values())
+
+    def compute(self) -> TrainingBatch:
+        """Рассчитать все тренировки хранилища одним пакетом."""
+        return compute_batch(self.workout_type, self.columns)
+
+
+def read_packages(packets: Iterable[Tuple[str, Sequence[float]]]
+                  ) -> Dict[str, TrainingStore]:
+    """Прочитать пакеты, разложив их по видам тренировок.
+
+    Каждый вид дальше считается одним `TrainingStore.compute()`
+    вместо отдельного объекта на пакет.
+    """
+    stores: Dict[str, TrainingStore] = {}
+    for workout_type, data in packets:
+        store = stores.get(workout_type)
+        if store is None:
+            store = stores[workout_type] = TrainingStore(workout_type)
+        store.append(data)
+    return stores
+
+
+@dataclass
+class CacheStats:
+    """Статистика кеша результатов."""
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+
+class ResultCache:
+    """LRU-кеш сообщений по виду тренировки и данным пакета.
+
+    Повторно присланный пакет не создаёт `Training` заново: возвращается
+    тот же объект `InfoMessage`, поэтому менять его нельзя. Текст
+    сообщения собирается при первом запросе `message` и тоже хранится,
+    так что повтор не форматируется заново.
+    """
+
+    def __init__(self, maxsize: int = 65536) -> None:
+        self.maxsize = maxsize
+        self.stats = CacheStats()
+        # Запись — [сообщение, его текст или None, пока не запрошен].
+        self._results: 'OrderedDict[tuple, list]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    def _entry(self, workout_type: str, data: Sequence[float]) -> list:
+        """Запись кеша для пакета, посчитанная при промахе."""
+        key = (workout_type, tuple(data))
+        results = self._results
+        entry = results.get(key)
+        if entry is not None:
+            results.move_to_end(key)
+            self.stats.hits += 1
+            return entry
+        self.stats.misses += 1
+        entry = [read_package(workout_type, data).show_training_info(), None]
+        self._store(key, entry)
+        return entry
+
+    def _store(self, key: tuple, entry: list) -> None:
+        results = self._results
+        results[key] = entry
+        if len(results) > self.maxsize:
+            results.popitem(last=False)
+            self.stats.evictions += 1
+
+    def training_info(self,
+                      workout_type: str,
+                      data: Sequence[float]
+                      ) -> InfoMessage:
+        """Вернуть сообщение о тренировке, посчитав его при промахе."""
+        return self._entry(workout_type, data)[0]
+
+    def message(self, workout_type: str, data: Sequence[float]) -> str:
+        """Вернуть текст `get_message` для пакета, собрав его один раз."""
+        entry = self._entry(workout_type, data)
+        if entry[1] is None:
+            entry[1] = entry[0].get_message()
+        return entry[1]
+
+    def get(self,
+            workout_type: str,
+            data: Sequence[float]
+            ) -> Optional[InfoMessage]:
+        """Вернуть сообщение из кеша или None, учтя попадание или промах."""
+        key = (workout_type, tuple(data))
+        entry = self._results.get(key)
+        if entry is None:
+            self.stats.misses += 1
+            return None
+        self._results.move_to_end(key)
+        self.stats.hits += 1
+        return entry[0]
+
+    def put(self,
+            workout_type: str,
+            data: Sequence[float],
+            info: InfoMessage
+            ) -> None:
+        """Положить сообщение в кеш, вытеснив самое старое при переполнении."""
+        self._store((workout_type, tuple(data)), [info, None])
+
+    def clear(self) -> None:
+        """Очистить кеш и статистику."""
+        self._results.clear()
+        self.stats = CacheStats()
+
+
+def parse_packet(line: str) -> Tuple[str, List[float]]:
+    """Разобрать строку пакета в формате JSON или CSV.
+
+    Поддерживаются `["RUN", [15000, 1, 75]]`,
+    `{"workout_type": "RUN", "data": [15000, 1, 75]}` и `RUN,15000,1,75`.
+    """
+    line = line.strip()
+    if line.startswith(('[', '{')):
+        import json
+
+        packet = json.loads(line)
+        if isinstance(packet, dict):
+            return packet['workout_type'], packet['data']
+        workout_type, data = packet
+        return workout_type, data
+    workout_type, *data = line.split(',')
+    return workout_type.strip(), [_to_number(value) for value in data]
+
+
+def _to_number(value: str) -> float:
+    """Преобразовать поле CSV в int, а если не выйдет — во float."""
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def read_lines(paths: Iterable[str]) -> Iterator[str]:
+    """Построчно читать файлы по очереди, `-` означает stdin."""
+    for path in paths:
+        if path == '-':
+            yield from sys.stdin
+        else:
+            with open(path, encoding='utf-8') as file:
+                yield from file
+
+
+def read_packets(lines: Iterable[str]) -> Iterator[Tuple[str, List[float]]]:
+    """Лениво разбирать пакеты, пропуская пустые строки."""
+    for line in lines:
+        if line.strip():
+            yield parse_packet(line)
+
+
+def stream_training_info(lines: Iterable[str],
+                         cache: Optional['ResultCache'] = None
+                         ) -> Iterator[InfoMessage]:
+    """Лениво превращать строки пакетов в информационные сообщения.
+
+    Следующая строка читается только когда потребитель запросил
+    очередное сообщение: память не зависит от размера входа, а медленный
+    писатель сам притормаживает чтение. С `cache` повторные пакеты
+    берутся из кеша.
+    """
+    for workout_type, data in read_packets(lines):
+        if cache is not None:
+            yield cache.training_info(workout_type, data)
+        else:
+            yield read_package(workout_type, data).show_training_info()
+
+
+def stream_training_text(lines: Iterable[str],
+                         cache: 'ResultCache'
+                         ) -> Iterator[str]:
+    """Как `stream_training_info`, но сразу тексты сообщений из `cache`.
+
+    Повторный пакет не пересчитывается и не форматируется заново.
+    """
+    for workout_type, data in read_packets(lines):
+        yield cache.message(workout_type, data)
+
+
+@dataclass
+class RejectedPacket:
+    """Пакет, не прошедший проверку, и причина отказа."""
+    packet: object
+    reason: str
+
+
+def _is_number(value: object) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _check_arity(packet: object) -> Optional[str]:
+    """Причина отказа по виду и числу полей пакета или None."""
+    try:
+        workout_type, data = packet
+    except (TypeError, ValueError):
+        return 'пакет должен быть парой (вид, данные)'
+    training_class = (TRAINING_TYPES.get(workout_type)
+                      if isinstance(workout_type, str) else None)
+    if training_class is None:
+        return 'неизвестный вид тренировки %r' % (workout_type,)
+    if not isinstance(data, (list, tuple)) or not all(map(_is_number, data)):
+        return 'данные должны быть списком чисел'
+    if len(data) != len(training_class.FIELDS):
+        return ('%s ожидает %d значений, получено %d'
+                % (training_class.__name__, len(training_class.FIELDS),
+                   len(data)))
+    return None
+
+
+def _as_float(value: float) -> float:
+    """Число как float; целое вне диапазона float — бесконечность."""
+    try:
+        return float(value)
+    except OverflowError:
+        return float('inf')
+
+
+def _check_ranges(training_class: Type[Training],
+                  columns: Sequence[Sequence[float]]
+                  ) -> List[Optional[str]]:
+    """Проверить значения пакетов одного вида по колонкам.
+
+    Колонки идут в порядке `FIELDS`. Все поля должны быть конечными
+    в float и неотрицательными, поля из `NONZERO_FIELDS` — больше
+    нуля. С NumPy проверка идёт сразу по всей колонке, в цикле Python
+    разбираются только плохие строки.
+    """
+    reasons: List[Optional[str]] = [None] * len(columns[0])
+    numpy = _load_numpy()
+    for name, values in zip(training_class.FIELDS, columns):
+        nonzero = name in training_class.NONZERO_FIELDS
+        if numpy is not None:
+            try:
+                column = numpy.asarray(values, dtype=float)
+            except OverflowError:
+                column = numpy.array([_as_float(value) for value in values],
+                                     dtype=float)
+            with numpy.errstate(invalid='ignore'):
+                bad = ~numpy.isfinite(column) | (column < 0)
+                if nonzero:
+                    bad |= column == 0
+            bad_rows = numpy.flatnonzero(bad).tolist()
+        else:
+            bad_rows = [
+                row_index for row_index, value in enumerate(values)
+                if not (0 <= _as_float(value) < float('inf'))
+                or (nonzero and value == 0)
+            ]
+        for row_index in bad_rows:
+            if reasons[row_index] is None:
+                reasons[row_index] = (
+                    'поле %s должно быть конечным и %s нуля'
+                    % (name, 'больше' if nonzero else 'не меньше'))
+    return reasons
+
+
+def _check_results(training_class: Type[Training],
+                   columns: Sequence[Sequence[float]]
+                   ) -> List[Union[str, InfoMessage]]:
+    """Посчитать пакеты и отклонить те, у которых расчёт переполняется.
+
+    С NumPy колонки считаются одним пакетным расчётом, без NumPy —
+    по строкам. Годен пакет с конечными дистанцией, скоростью и
+    калориями; для него возвращается готовое сообщение, для плохого —
+    причина отказа.
+    """
+    reason = 'результат расчёта не помещается в float'
+    numpy = _load_numpy()
+    if numpy is not None and len(columns[0]):
+        with numpy.errstate(all='ignore'):
+            info = training_class(*numpy.array(
+                columns, dtype=float)).show_training_info()
+            finite = (numpy.isfinite(info.distance)
+                      & numpy.isfinite(info.speed)
+                      & numpy.isfinite(info.calories))
+        duration = columns[training_class.FIELDS.index('duration')]
+        return [InfoMessage(info.training_type, *values) if ok else reason
+                for ok, *values in zip(finite.tolist(), _as_list(duration),
+                                       info.distance.tolist(),
+                                       info.speed.tolist(),
+                                       info.calories.tolist())]
+    results: List[Union[str, InfoMessage]] = []
+    for row in zip(*columns):
+        try:
+            info = training_class(*row).show_training_info()
+        except ArithmeticError:
+            results.append(reason)
+            continue
+        finite = all(abs(value) < float('inf') for value in
+                     (info.distance, info.speed, info.calories))
+        results.append(info if finite else reason)
+    return results
+
+
+def _validate(packets: Sequence[object],
+              cache: Optional['ResultCache'] = None
+              ) -> Tuple[List[Optional[InfoMessage]], List[Optional[str]]]:
+    """Сообщения годных пакетов и причины отказа плохих, по порядку.
+
+    Пакет, уже лежащий в `cache`, проверку прошёл раньше: его
+    сообщение берётся из кеша. Новые годные сообщения кладутся туда.
+    """
+    reasons: List[Optional[str]] = [_check_arity(packet)
+                                    for packet in packets]
+    infos: List[Optional[InfoMessage]] = [None] * len(packets)
+    groups: Dict[str, List[int]] = {}
+    for index, packet in enumerate(packets):
+        if reasons[index] is None:
+            if cache is not None:
+                infos[index] = cache.get(*packet)
+            if infos[index] is None:
+                groups.setdefault(packet[0], []).append(index)
+    for workout_type, indices in groups.items():
+        checked = _validate_columns(TRAINING_TYPES[workout_type], list(
+            zip(*[packets[index][1] for index in indices])))
+        for index, (info, reason) in zip(indices, zip(*checked)):
+            infos[index], reasons[index] = info, reason
+            if cache is not None and info is not None:
+                cache.put(workout_type, packets[index][1], info)
+    return infos, reasons
+
+
+def _validate_columns(training_class: Type[Training],
+                      columns: Sequence[Sequence[float]]
+                      ) -> Tuple[List[Optional[InfoMessage]],
+                                 List[Optional[str]]]:
+    """Проверить и посчитать пакеты одного вида, заданные колонками."""
+    reasons = _check_ranges(training_class, columns)
+    good = [index for index, reason in enumerate(reasons) if reason is None]
+    if len(good) < len(reasons):
+        columns = [[column[index] for index in good] for column in columns]
+    infos: List[Optional[InfoMessage]] = [None] * len(reasons)
+    for index, result in zip(good, _check_results(training_class, columns)):
+        if isinstance(result, str):
+            reasons[index] = result
+        else:
+            infos[index] = result
+    return infos, reasons
+
+
+def validate_packets(packets: Sequence[object]
+                     ) -> Tuple[List[Tuple[str, Sequence[float]]],
+                                List[RejectedPacket]]:
+    """Отделить пакеты, которые посчитаются без ошибок, от плохих.
+
+    Проверяются вид тренировки, число полей, конечность и знак
+    значений, нули в делителях и переполнение при расчёте. Годные
+    пакеты возвращаются в исходном порядке, плохие — с причиной
+    отказа.
+    """
+    _, reasons = _validate(packets)
+    good = [packet for packet, reason in zip(packets, reasons)
+            if reason is None]
+    rejected = [RejectedPacket(packet, reason)
+                for packet, reason in zip(packets, reasons)
+                if reason is not None]
+    return good, rejected
+
+
+def write_rejected(rejected: Iterable[RejectedPacket],
+                   output: TextIO) -> int:
+    """Записать отклонённые пакеты в JSON Lines: пакет и причина."""
+    import json
+
+    count = 0
+    for count, packet in enumerate(rejected, 1):
+        output.write(json.dumps(asdict(packet), ensure_ascii=False,
+                                default=repr) + '\n')
+    return count
+
+
+def _parse_lines(lines: List[str]
+                 ) -> Tuple[List[object], List[RejectedPacket]]:
+    """Разобрать строки пакетов, отложив неразборчивые."""
+    packets, rejected = [], []
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            packets.append(parse_packet(line))
+        except (ValueError, KeyError, TypeError,
+                OverflowError) as error:
+            rejected.append(RejectedPacket(line.strip(),
+                                           'не удалось разобрать: %s'
+                                           % error))
+    return packets, rejected
+
+
+def validated_training_info(lines: Iterable[str],
+                            dead_letter: TextIO,
+                            chunk_size: int = 1000,
+                            cache: Optional['ResultCache'] = None
+                            ) -> Iterator[InfoMessage]:
+    """Как `stream_training_info`, но плохие пакеты уходят в `dead_letter`.
+
+    Строки проверяются кусками по `chunk_size`; ошибка в пакете не
+    останавливает обработку остальных. Сообщения годных пакетов
+    считаются один раз, при проверке.
+    """
+    for chunk in chunked(lines, chunk_size):
+        packets, rejected = _parse_lines(chunk)
+        infos, reasons = _validate(packets, cache)
+        write_rejected(rejected + [
+            RejectedPacket(packet, reason)
+            for packet, reason in zip(packets, reasons)
+            if reason is not None
+        ], dead_letter)
+        for info in infos:
+            if info is not None:
+                yield info
+
+
+def chunked(items: Iterable, size: int) -> Iterator[list]:
+    """Нарезать поток на списки длиной не больше `size`."""
+    iterator = iter(items)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+_worker_cache: Optional['ResultCache'] = None
+
+
+def _init_worker(cache_size: int) -> None:
+    """Завести кеш результатов в процессе-исполнителе."""
+    global _worker_cache
+    _worker_cache = ResultCache(cache_size) if cache_size else None
+
+
+def _process_chunk(lines: List[str]) -> List[InfoMessage]:
+    """Обработать кусок строк пакетов в процессе-исполнителе."""
+    return list(stream_training_info(lines, _worker_cache))
+
+
+def _next_done(pending: 'deque[Future]', ordered: bool) -> List[InfoMessage]:
+    """Дождаться очередного куска: первого по порядку или любого готового."""
+    if ordered:
+        return pending.popleft().result()
+    from concurrent.futures import FIRST_COMPLETED, wait
+
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    future = done.pop()
+    pending.remove(future)
+    return future.result()
+
+
+def parallel_training_info(lines: Iterable[str],
+                           workers: Optional[int] = None,
+                           chunk_size: int = 1000,
+                           ordered: bool = True,
+                           cache_size: int = 0
+                           ) -> Iterator[InfoMessage]:
+    """Обработать строки пакетов в пуле процессов.
+
+    Вход режется на куски по `chunk_size` строк, в работе одновременно
+    не больше двух кусков на процесс. При `ordered=False` куски
+    отдаются по мере готовности, порядок внутри куска сохраняется.
+    С `cache_size` у каждого процесса свой `ResultCache`.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(workers, initializer=_init_worker,
+                             initargs=(cache_size,)) as executor:
+        max_pending = 2 * workers
+        pending: 'deque[Future]' = deque()
+        for chunk in chunked(lines, chunk_size):
+            pending.append(executor.submit(_process_chunk, chunk))
+            if len(pending) >= max_pending:
+                yield from _next_done(pending, ordered)
+        while pending:
+            yield from _next_done(pending, ordered)
+
+
+def format_messages(messages: Iterable[InfoMessage]) -> str:
+    """Строки `get_message` для сообщений, склеенные с переводами строк."""
+    line = InfoMessage.LINE
+    return ''.join([line % (info.training_type,
+                            info.duration,
+                            info.distance,
+                            info.speed,
+                            info.calories)
+                    for info in messages])
+
+
+def format_results(training_type: str,
+                   rows: Iterable[Tuple[float, float, float, float]]
+                   ) -> str:
+    """Строки `get_message` для строк (duration, distance, speed, calories)."""
+    line = InfoMessage.LINE
+    return ''.join([line % (training_type, duration, distance, speed,
+                            calories)
+                    for duration, distance, speed, calories in rows])
+
+
+def write_texts(texts: Iterable[str],
+                output: TextIO,
+                batch_size: int = 1000
+                ) -> int:
+    """Записать готовые тексты сообщений пачками по `batch_size` строк."""
+    count = 0
+    for chunk in chunked(texts, batch_size):
+        output.write('\n'.join(chunk) + '\n')
+        count += len(chunk)
+    return count
+
+
+def write_messages(messages: Iterable[InfoMessage],
+                   output: TextIO,
+                   batch_size: int = 1000
+                   ) -> int:
+    """Записать сообщения в поток по одному на строку.
+
+    Строки совпадают с `get_message`, но собираются через
+    `InfoMessage.LINE` и пишутся в поток пачками по `batch_size`.
+    """
+    count = 0
+    for chunk in chunked(messages, batch_size):
+        output.write(format_messages(chunk))
+        count += len(chunk)
+    return count
+
+
+def _as_list(column: Sequence[float]) -> Sequence[float]:
+    """Колонка NumPy или array('d') как список чисел Python."""
+    return column.tolist() if hasattr(column, 'tolist') else column
+
+
+def batch_messages(batch: TrainingBatch) -> Iterator[InfoMessage]:
+    """Сообщения о тренировках пакетного расчёта по одному."""
+    training_type = batch.training_type
+    for values in zip(*(_as_list(column) for column in (batch.duration,
+                                                        batch.distance,
+                                                        batch.speed,
+                                                        batch.calories))):
+        yield InfoMessage(training_type, *values)
+
+
+def write_batch(batch: TrainingBatch,
+                output: TextIO,
+                batch_size: int = 1000
+                ) -> int:
+    """Записать результаты пакетного расчёта пачками по `batch_size`."""
+    columns = [_as_list(column) for column in (batch.duration,
+                                               batch.distance,
+                                               batch.speed,
+                                               batch.calories)]
+    for chunk in chunked(zip(*columns), batch_size):
+        output.write(format_results(batch.training_type, chunk))
+    return len(batch)
+
+
+# Двоичный формат пакетов: последовательность блоков, в блоке пакеты
+# одного вида. Заголовок блока — сигнатура, версия, код вида и число
+# записей, за ним колонки полей `FIELDS` по порядку, каждая — подряд
+# идущие little-endian float64. Заголовок занимает 16 байт, так что
+# колонки выровнены по 8 байт.
+BINARY_MAGIC = b'HWPK'
+BINARY_VERSION = 1
+BLOCK_HEADER = struct.Struct('<4sB3sQ')
+
+
+def _write_block(store: TrainingStore, file: BinaryIO) -> None:
+    """Записать накопленные пакеты хранилища одним блоком."""
+    file.write(BLOCK_HEADER.pack(BINARY_MAGIC, BINARY_VERSION,
+                                 store.workout_type.encode('ascii'),
+                                 len(store)))
+    for column in store.columns.values():
+        if sys.byteorder == 'big':
+            column = array('d', column)
+            column.byteswap()
+        file.write(column.tobytes())
+
+
+def write_binary(packets: Iterable[Tuple[str, Sequence[float]]],
+                 file: BinaryIO,
+                 block_size: int = 65536
+                 ) -> int:
+    """Записать пакеты вида `('RUN', [15000, 1, 75])` в двоичный формат.
+
+    Пакеты копятся по видам и сбрасываются блоками по `block_size`
+    записей, поэтому порядок сохраняется только внутри вида.
+    """
+    stores: Dict[str, TrainingStore] = {}
+    written = 0
+    for workout_type, data in packets:
+        store = stores.get(workout_type)
+        if store is None:
+            store = stores[workout_type] = TrainingStore(workout_type)
+        store.append(data)
+        if len(store) >= block_size:
+            _write_block(store, file)
+            written += len(store)
+            stores[workout_type] = TrainingStore(workout_type)
+    for store in stores.values():
+        if len(store):
+            _write_block(store, file)
+            written += len(store)
+    return written
+
+
+def _column_view(buffer: mmap.mmap, offset: int, size: int) -> Sequence:
+    """Колонка из `size` чисел в отображённом файле без копирования."""
+    numpy = _load_numpy()
+    if numpy is not None:
+        return numpy.frombuffer(buffer, dtype='<f8', count=size, offset=offset)
+    column = memoryview(buffer)[offset:offset + 8 * size]
+    if sys.byteorder == 'big':
+        column = array('d', column.tobytes())
+        column.byteswap()
+        return column
+    return column.cast('d')
+
+
+def iter_binary_blocks(path: str
+                       ) -> Iterator[Tuple[str, Dict[str, Sequence[float]]]]:
+    """Читать блоки двоичного файла через mmap.
+
+    Колонки — представления NumPy или memoryview прямо над
+    отображённым файлом, в кучу данные не копируются.
+    """
+    with open(path, 'rb') as file:
+        if not os.fstat(file.fileno()).st_size:
+            return
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    offset = 0
+    while offset < len(buffer):
+        magic, version, code, size = BLOCK_HEADER.unpack_from(buffer, offset)
+        if magic != BINARY_MAGIC or version != BINARY_VERSION:
+            raise ValueError('%s: неизвестный блок по смещению %d'
+                             % (path, offset))
+        workout_type = code.decode('ascii')
+        fields = get_training_class(workout_type).FIELDS
+        offset += BLOCK_HEADER.size
+        if offset + 8 * size * len(fields) > len(buffer):
+            raise ValueError('%s: блок по смещению %d обрезан'
+                             % (path, offset - BLOCK_HEADER.size))
+        columns = {}
+        for name in fields:
+            columns[name] = _column_view(buffer, offset, size)
+            offset += 8 * size
+        yield workout_type, columns
+
+
+def read_binary(path: str,
+                executor: Optional[BatchExecutor] = None
+                ) -> Iterator[TrainingBatch]:
+    """Рассчитать тренировки двоичного файла поблочно.
+
+    С `executor` блоки считаются параллельно в его потоках.
+    """
+    if executor is not None:
+        yield from executor.map(iter_binary_blocks(path))
+        return
+    for workout_type, columns in iter_binary_blocks(path):
+        yield compute_batch(workout_type, columns)
+
+
+def validated_binary(path: str, dead_letter: TextIO) -> Iterator[InfoMessage]:
+    """Как `read_binary`, но плохие записи уходят в `dead_letter`.
+
+    Блок проверяется по колонкам теми же правилами, что и текстовые
+    пакеты; отклонённая запись пишется как пакет `(вид, данные)`.
+    """
+    for workout_type, columns in iter_binary_blocks(path):
+        training_class = TRAINING_TYPES[workout_type]
+        infos, reasons = _validate_columns(
+            training_class, [columns[name] for name in training_class.FIELDS])
+        write_rejected([
+            RejectedPacket((workout_type, [column[index] for column
+                                           in columns.values()]), reason)
+            for index, reason in enumerate(reasons) if reason is not None
+        ], dead_letter)
+        yield from (info for info in infos if info is not None)
+
+
+@dataclass
+class WindowTotals:
+    """Суммы тренировок за окно времени."""
+    workouts: int = 0
+    duration: float = 0.0
+    distance: float = 0.0
+    calories: float = 0.0
+    # Скорость, взвешенная длительностью: сумма speed * duration.
+    speed_hours: float = 0.0
+
+    @property
+    def mean_speed(self) -> float:
+        """Средняя скорость, взвешенная длительностью тренировок."""
+        return self.speed_hours / self.duration if self.duration else 0.0
+
+    def add(self, info: InfoMessage) -> None:
+        """Учесть одну тренировку."""
+        self.workouts += 1
+        self.duration += info.duration
+        self.distance += info.distance
+        self.calories += info.calories
+        self.speed_hours += info.speed * info.duration
+
+    def subtract(self, other: 'WindowTotals') -> None:
+        """Вычесть суммы, ушедшие из окна."""
+        self.workouts -= other.workouts
+        self.duration -= other.duration
+        self.distance -= other.distance
+        self.calories -= other.calories
+        self.speed_hours -= other.speed_hours
+
+
+class RollingWindow:
+    """Скользящее окно длиной `length` секунд из корзин по `bucket` секунд.
+
+    Окно сдвигается целыми корзинами: устаревшая корзина вычитается из
+    итогов целиком, так что добавление и устаревание стоят O(1)
+    в среднем, а память ограничена числом корзин.
+    """
+
+    def __init__(self, length: float, bucket: float) -> None:
+        self.bucket = bucket
+        self.size = max(1, round(length / bucket))
+        self.totals = WindowTotals()
+        self.buckets: 'deque[Tuple[int, WindowTotals]]' = deque()
+
+    def add(self, timestamp: float, info: InfoMessage) -> bool:
+        """Учесть тренировку; слишком старую — пропустить и вернуть False."""
+        key = int(timestamp // self.bucket)
+        buckets = self.buckets
+        if buckets and key <= buckets[-1][0] - self.size:
+            return False
+        if not buckets or key > buckets[-1][0]:
+            buckets.append((key, WindowTotals()))
+            self.expire(timestamp)
+            totals = buckets[-1][1]
+        else:
+            totals = self._late_bucket(key)
+        totals.add(info)
+        self.totals.add(info)
+        return True
+
+    def _late_bucket(self, key: int) -> WindowTotals:
+        """Найти или вставить по порядку корзину опоздавшей тренировки."""
+        buckets = self.buckets
+        index = len(buckets)
+        while index and buckets[index - 1][0] > key:
+            index -= 1
+        if index and buckets[index - 1][0] == key:
+            return buckets[index - 1][1]
+        totals = WindowTotals()
+        buckets.insert(index, (key, totals))
+        return totals
+
+    def expire(self, now: float) -> None:
+        """Убрать корзины, вышедшие из окна к моменту `now`."""
+        oldest = int(now // self.bucket) - self.size
+        buckets = self.buckets
+        while buckets and buckets[0][0] <= oldest:
+            self.totals.subtract(buckets.popleft()[1])
+        if not buckets:
+            self.totals = WindowTotals()
+
+
+class AthleteAggregator:
+    """Скользящие итоги тренировок по атлетам без пересчёта истории.
+
+    `windows` задаёт окна как имя -> (длина, размер корзины) в
+    секундах. Атлеты без тренировок в окнах удаляются `expire`, а при
+    `max_athletes` дольше всех неактивные атлеты вытесняются сразу.
+    """
+    WINDOWS: Dict[str, Tuple[float, float]] = {
+        'day': (24 * 3600, 3600),
+        'week': (7 * 24 * 3600, 24 * 3600),
     }
+
+    def __init__(self,
+                 windows: Optional[Dict[str, Tuple[float, float]]] = None,
+                 max_athletes: Optional[int] = None
+                 ) -> None:
+        self.windows = dict(windows or self.WINDOWS)
+        self.max_athletes = max_athletes
+        self._athletes: 'OrderedDict[Hashable, Dict[str, RollingWindow]]' = (
+            OrderedDict())
+
+    def __len__(self) -> int:
+        return len(self._athletes)
+
+    def add(self,
+            athlete: Hashable,
+            timestamp: float,
+            result: Union[Training, InfoMessage]
+            ) -> None:
+        """Учесть тренировку атлета, завершённую в `timestamp`."""
+        if isinstance(result, Training):
+            result = result.show_training_info()
+        athletes = self._athletes
+        windows = athletes.get(athlete)
+        if windows is None:
+            windows = athletes[athlete] = {
+                name: RollingWindow(length, bucket)
+                for name, (length, bucket) in self.windows.items()
+            }
+            if self.max_athletes and len(athletes) > self.max_athletes:
+                athletes.popitem(last=False)
+        else:
+            athletes.move_to_end(athlete)
+        for window in windows.values():
+            window.add(timestamp, result)
+
+    def totals(self,
+               athlete: Hashable,
+               window: str,
+               now: Optional[float] = None
+               ) -> WindowTotals:
+        """Вернуть итоги атлета за окно на момент `now`."""
+        windows = self._athletes.get(athlete)
+        if windows is None:
+            return WindowTotals()
+        rolling = windows[window]
+        if now is not None:
+            rolling.expire(now)
+        totals = rolling.totals
+        return WindowTotals(totals.workouts, totals.duration,
+                            totals.distance, totals.calories,
+                            totals.speed_hours)
+
+    def expire(self, now: float) -> int:
+        """Сдвинуть все окна к `now` и убрать атлетов без тренировок."""
+        idle = []
+        for athlete, windows in self._athletes.items():
+            for window in windows.values():
+                window.expire(now)
+            if not any(window.buckets for window in windows.values()):
+                idle.append(athlete)
+        for athlete in idle:
+            del self._athletes[athlete]
+        return len(idle)
+
+
+class SampleWindow:
+    """Скользящее окно последних `length` секунд отсчётов датчика.
+
+    Отсчёты лежат в кольцевом буфере на `capacity` мест, сумма действий
+    в окне поддерживается на ходу, так что добавление стоит O(1)
+    в среднем. При переполнении вытесняются самые старые отсчёты.
+    """
+
+    def __init__(self, length: float, capacity: int = 4096) -> None:
+        if length <= 0 or capacity <= 0:
+            raise ValueError('Длина окна и ёмкость буфера должны быть '
+                             'больше нуля.')
+        self.length = length
+        self.actions = 0.0
+        self._times = array('d', bytes(8 * capacity))
+        self._actions = array('d', bytes(8 * capacity))
+        self._head = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, timestamp: float, actions: float) -> None:
+        """Добавить отсчёт и вытеснить вышедшие из окна."""
+        capacity = len(self._times)
+        if self._size == capacity:
+            self._pop()
+        index = (self._head + self._size) % capacity
+        self._times[index] = timestamp
+        self._actions[index] = actions
+        self._size += 1
+        self.actions += actions
+        oldest = timestamp - self.length
+        while self._times[self._head] <= oldest:
+            self._pop()
+
+    def span(self) -> Tuple[float, float]:
+        """Действия и секунды между первым и последним отсчётом окна.
+
+        Действия первого отсчёта пришлись на время до него и не входят.
+        """
+        if self._size < 2:
+            return 0.0, 0.0
+        newest = (self._head + self._size - 1) % len(self._times)
+        return (self.actions - self._actions[self._head],
+                self._times[newest] - self._times[self._head])
+
+    def _pop(self) -> None:
+        self.actions -= self._actions[self._head]
+        self._head = (self._head + 1) % len(self._times)
+        self._size -= 1
+
+    def clear(self) -> None:
+        """Опустошить окно."""
+        self._head = self._size = 0
+        self.actions = 0.0
+
+
+@dataclass
+class Segment:
+    """Круг тренировки, собранный из отсчётов датчика.
+
+    Отрезки разделяются паузами, круги внутри отрезка — пройденной
+    дистанцией. `start` и `end` — время первого и последнего отсчёта
+    в секундах.
+    """
+    segment: int
+    lap: int
+    start: float
+    end: float
+    info: InfoMessage
+
+
+class SensorStream:
+    """Режет поток отсчётов датчика одного спортсмена на отрезки и круги.
+
+    Отсчёт — время в секундах и число шагов или гребков с прошлого
+    отсчёта. Перерыв дольше `pause` секунд начинает новый отрезок,
+    каждые `lap` км внутри отрезка закрывается круг. Круг считается
+    обычной тренировкой вида `workout_type`: `action` и `duration`
+    берутся из отсчётов, остальные поля — из `profile`. Для плавания
+    без `count_pool` в профиле число бассейнов выводится из дистанции.
+    """
+
+    def __init__(self,
+                 workout_type: str,
+                 profile: Dict[str, float],
+                 pause: float = 30.0,
+                 lap: float = 1.0,
+                 window: float = 10.0,
+                 capacity: int = 4096
+                 ) -> None:
+        self.workout_type = workout_type
+        self.training_class = get_training_class(workout_type)
+        self.profile = profile
+        self.pause = pause
+        self.lap_actions = (lap * self.training_class.M_IN_KM
+                            / self.training_class.LEN_STEP)
+        self.window = SampleWindow(window, capacity)
+        self.segment = -1
+        self.lap = 0
+        self._start: Optional[float] = None
+        self._last: Optional[float] = None
+        self._actions = 0.0
+
+    def _training(self, actions: float, seconds: float) -> Training:
+        values = dict(self.profile, action=actions,
+                      duration=seconds / 3600)
+        if ('count_pool' in self.training_class.FIELDS
+                and 'count_pool' not in self.profile):
+            values['count_pool'] = (actions * self.training_class.LEN_STEP
+                                    / self.profile['length_pool'])
+        return read_package(self.workout_type,
+                            [values[name]
+                             for name in self.training_class.FIELDS])
+
+    def add(self, timestamp: float, actions: float = 1) -> List[Segment]:
+        """Учесть отсчёт и вернуть закрытые им круги.
+
+        Действия первого отсчёта отрезка пришлись на паузу и не
+        считаются: он только отмечает начало отрезка.
+        """
+        last = self._last
+        if last is not None and timestamp < last:
+            raise ValueError('Отсчёты должны идти по времени: %r после %r'
+                             % (timestamp, last))
+        self._last = timestamp
+        if last is None or timestamp - last > self.pause:
+            closed = self._close_lap(last) if last is not None else []
+            self.segment += 1
+            self.lap = 0
+            self._start = timestamp
+            self._actions = 0.0
+            self.window.clear()
+            self.window.add(timestamp, 0)
+            return closed
+        self._actions += actions
+        self.window.add(timestamp, actions)
+        if self._actions >= self.lap_actions and timestamp > self._start:
+            return self._close_lap(timestamp)
+        return []
+
+    def _close_lap(self, end: float) -> List[Segment]:
+        start, actions = self._start, self._actions
+        self._start, self._actions = end, 0.0
+        if end <= start:
+            return []
+        lap = self.lap
+        self.lap += 1
+        return [Segment(self.segment, lap, start, end,
+                        self._training(actions, end - start)
+                        .show_training_info())]
+
+    def close(self) -> List[Segment]:
+        """Закрыть последний круг в конце потока."""
+        if self._last is None:
+            return []
+        return self._close_lap(self._last)
+
+    def current(self) -> Optional[InfoMessage]:
+        """Метрики за последние секунды окна текущего отрезка."""
+        actions, seconds = self.window.span()
+        if seconds <= 0:
+            return None
+        return self._training(actions, seconds).show_training_info()
+
+
+def split_samples(samples: Iterable[Tuple[float, float]],
+                  workout_type: str,
+                  profile: Dict[str, float],
+                  pause: float = 30.0,
+                  lap: float = 1.0
+                  ) -> Iterator[Segment]:
+    """Лениво разрезать отсчёты одного спортсмена на круги."""
+    stream = SensorStream(workout_type, profile, pause, lap)
+    for timestamp, actions in samples:
+        yield from stream.add(timestamp, actions)
+    yield from stream.close()
+
+
+def format_reply(line: Union[bytes, str],
+                 structured: bool,
+                 cache: Optional[ResultCache]
+                 ) -> str:
+    """Посчитать ответ сервера на одну строку пакета.
+
+    Ошибка в пакете, включая не UTF-8 байты и переполнение в расчёте,
+    не поднимается, а возвращается строкой ответа.
+    """
+    import json
+
+    try:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        workout_type, data = parse_packet(line)
+        if cache is not None and not structured:
+            return cache.message(workout_type, data)
+        if cache is not None:
+            info = cache.training_info(workout_type, data)
+        else:
+            info = read_package(workout_type, data).show_training_info()
+    except (ValueError, TypeError, KeyError, ArithmeticError) as error:
+        if structured:
+            return json.dumps({'error': repr(error)}, ensure_ascii=False)
+        return 'Ошибка: %r' % (error,)
+    if structured:
+        return json.dumps(asdict(info), ensure_ascii=False)
+    return info.get_message()
+
+
+async def handle_connection(reader: 'asyncio.StreamReader',
+                            writer: 'asyncio.StreamWriter',
+                            limit: 'asyncio.Semaphore',
+                            structured: bool = False,
+                            cache: Optional[ResultCache] = None
+                            ) -> None:
+    """Отвечать на пакеты одного соединения по строке на пакет.
+
+    Клиент может слать пакеты не дожидаясь ответов: ответы идут в
+    порядке запросов. Ошибочный пакет получает строку с ошибкой, а
+    соединение продолжает работать.
+    """
+    async with limit:
+        try:
+            async for line in reader:
+                if line.strip():
+                    reply = format_reply(line, structured, cache)
+                    writer.write((reply + '\n').encode())
+                    await writer.drain()
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+
+async def start_server(host: Optional[str] = None,
+                       port: Optional[int] = None,
+                       path: Optional[str] = None,
+                       max_connections: int = 1024,
+                       structured: bool = False,
+                       cache_size: int = 0
+                       ) -> 'asyncio.AbstractServer':
+    """Запустить сервер приёма пакетов на TCP-порту или Unix-сокете.
+
+    Одновременно обслуживается не больше `max_connections`
+    соединений, остальные ждут своей очереди. С `structured` ответы
+    приходят в JSON вместо текста `InfoMessage`.
+    """
+    import asyncio
+
+    handler = partial(handle_connection,
+                      limit=asyncio.Semaphore(max_connections),
+                      structured=structured,
+                      cache=ResultCache(cache_size) if cache_size else None)
+    if path is not None:
+        return await asyncio.start_unix_server(handler, path)
+    return await asyncio.start_server(handler, host, port)
+
+
+async def serve(**kwargs) -> None:
+    """Работать как сервер, пока процесс не остановят."""
+    server = await start_server(**kwargs)
+    async with server:
+        await server.serve_forever()
+
+
+# Шардированная обработка: координатор режет вход на шарды и раздаёт
+# их исполнителям через локальные Unix-сокеты. Исполнитель — отдельный
+# процесс `python homework.py --shard-worker PATH`, стоящий вместо узла.
+@dataclass
+class Shard:
+    """Часть входа: диапазон байт файла с пакетами."""
+
+    index: int
+    path: str
+    start: int = 0
+    end: int = 0
+
+
+def shard_by_range(paths: Sequence[str], shards: int) -> List[Shard]:
+    """Нарезать файлы на диапазоны байт, около `shards` на все файлы.
+
+    Шарду принадлежат строки, которые начинаются внутри его диапазона,
+    поэтому границы не нужно выравнивать по переводам строк. Сообщения
+    шардов, склеенные по порядку, идут в порядке входа.
+    """
+    sizes = [os.path.getsize(path) for path in paths]
+    step = max(1, -(-sum(sizes) // max(1, shards)))
+    result: List[Shard] = []
+    for path, size in zip(paths, sizes):
+        for start in range(0, size, step):
+            result.append(Shard(len(result), path, start,
+                                min(start + step, size)))
+    return result
+
+
+def athlete_key(line: str) -> str:
+    """Спортсмен пакета: поле `athlete` JSON-объекта, иначе вся строка."""
+    line = line.strip()
+    if line.startswith('{'):
+        import json
+
+        try:
+            athlete = json.loads(line).get('athlete')
+        except ValueError:
+            athlete = None
+        if athlete is not None:
+            return str(athlete)
+    return line
+
+
+def shard_by_athlete(lines: Iterable[str],
+                     shards: int,
+                     directory: str,
+                     key: Callable[[str], str] = athlete_key
+                     ) -> List[Shard]:
+    """Разложить пакеты по шардам по устойчивому хешу спортсмена.
+
+    Пакеты одного спортсмена попадают в один шард в порядке входа.
+    Каждый шард — файл в `directory`, так что вход проходит потоком
+    и не копится в памяти. Хеш не зависит от PYTHONHASHSEED, так что
+    разбиение повторяется от запуска к запуску.
+    """
+    import zlib
+    from contextlib import ExitStack
+
+    paths = [os.path.join(directory, 'athlete-%d.txt' % index)
+             for index in range(shards)]
+    with ExitStack() as stack:
+        files = [stack.enter_context(open(path, 'w', encoding='utf-8'))
+                 for path in paths]
+        for line in lines:
+            if line.strip():
+                bucket = zlib.crc32(key(line).encode('utf-8')) % shards
+                files[bucket].write(line.rstrip('\n') + '\n')
+    return [Shard(index, path, 0, os.path.getsize(path))
+            for index, path in enumerate(paths)]
+
+
+def _shard_lines(shard: Shard) -> Iterator[str]:
+    """Строки файла шарда, начатые в его диапазоне байт."""
+    with open(shard.path, 'rb') as file:
+        if shard.start:
+            file.seek(shard.start - 1)
+            file.readline()
+        while file.tell() < shard.end:
+            line = file.readline()
+            if not line:
+                break
+            yield line.decode('utf-8')
+
+
+def _shard_reply(shard: Shard) -> str:
+    """Посчитать шард и собрать ответ исполнителя.
+
+    Ответ — JSON-массив полей `RESULT_FIELDS` на каждое сообщение и
+    итоговая строка с их числом, либо одна строка с ошибкой.
+    """
+    import json
+
+    try:
+        rows = [json.dumps([getattr(info, name) for name in RESULT_FIELDS],
+                           ensure_ascii=False)
+                for info in stream_training_info(_shard_lines(shard))]
+    except (OSError, ValueError, TypeError, KeyError,
+            ArithmeticError) as error:
+        return json.dumps({'shard': shard.index, 'error': repr(error)},
+                          ensure_ascii=False) + '\n'
+    rows.append(json.dumps({'shard': shard.index, 'count': len(rows)}))
+    return '\n'.join(rows) + '\n'
+
+
+async def handle_shard_requests(reader: 'asyncio.StreamReader',
+                                writer: 'asyncio.StreamWriter'
+                                ) -> None:
+    """Считать шарды, которые присылает координатор по одному соединению.
+
+    Запрос — строка с JSON-описанием шарда, файл исполнитель читает сам.
+    """
+    import json
+
+    try:
+        async for header in reader:
+            request = json.loads(header)
+            shard = Shard(request['shard'], request['path'],
+                          request['start'], request['end'])
+            writer.write(_shard_reply(shard).encode('utf-8'))
+            await writer.drain()
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+
+async def start_shard_worker(path: str) -> 'asyncio.AbstractServer':
+    """Запустить исполнителя шардов на Unix-сокете."""
+    import asyncio
+
+    return await asyncio.start_unix_server(handle_shard_requests, path)
+
+
+async def serve_shards(path: str) -> None:
+    """Работать исполнителем шардов, пока процесс не остановят."""
+    server = await start_shard_worker(path)
+    async with server:
+        await server.serve_forever()
+
+
+class ShardCoordinator:
+    """Раздаёт шарды исполнителям и собирает результаты по порядку шардов.
+
+    Каждый исполнитель считает один шард за раз. Шард, на котором
+    исполнитель оборвал соединение или не уложился в `timeout` секунд,
+    уходит следующему свободному исполнителю, всего до `retries`
+    повторов. Ошибка в самих пакетах повторится на любом исполнителе,
+    поэтому на ней шард сразу завершается RuntimeError. Исполнитель,
+    к которому не подключиться, выбывает, а попытка шарда не
+    засчитывается. Все сбои копятся в `failures`.
+    """
+
+    def __init__(self,
+                 workers: Sequence[str],
+                 retries: int = 2,
+                 timeout: Optional[float] = None
+                 ) -> None:
+        self.workers = list(workers)
+        self.retries = retries
+        self.timeout = timeout
+        self.failures: List[Tuple[int, str, str]] = []
+
+    async def run(self, shards: Iterable[Shard]) -> List[List[InfoMessage]]:
+        """Посчитать шарды; i-й список — сообщения i-го шарда."""
+        return [messages async for messages in self.stream(shards)]
+
+    async def stream(self,
+                     shards: Iterable[Shard],
+                     window: Optional[int] = None
+                     ) -> AsyncIterator[List[InfoMessage]]:
+        """Выдавать сообщения шардов по порядку, как только они готовы.
+
+        Одновременно считается не больше `window` шардов, по умолчанию
+        вдвое больше, чем исполнителей: результаты шардов, обогнавших
+        первый невыданный, ждут в памяти только в пределах окна.
+        """
+        import asyncio
+
+        self._idle: 'asyncio.Queue[Optional[str]]' = asyncio.Queue()
+        for path in self.workers:
+            self._idle.put_nowait(path)
+        self._alive = len(self.workers)
+        if not self._alive:
+            self._idle.put_nowait(None)
+        window = window or 2 * max(1, self._alive)
+        pending: 'deque[asyncio.Task[List[InfoMessage]]]' = deque()
+        try:
+            for shard in shards:
+                if len(pending) >= window:
+                    yield await pending.popleft()
+                pending.append(asyncio.ensure_future(self._run_shard(shard)))
+            while pending:
+                yield await pending.popleft()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _run_shard(self, shard: Shard) -> List[InfoMessage]:
+        import asyncio
+
+        attempts = 0
+        while attempts <= self.retries:
+            path = await self._idle.get()
+            if path is None:
+                self._idle.put_nowait(None)
+                raise RuntimeError('Не осталось доступных исполнителей '
+                                   'для шарда %d' % shard.index)
+            try:
+                reader, writer = await asyncio.open_unix_connection(path)
+            except OSError as error:
+                self._fail(shard, path, error)
+                self._alive -= 1
+                if not self._alive:
+                    self._idle.put_nowait(None)
+                continue
+            attempts += 1
+            try:
+                return await asyncio.wait_for(
+                    self._exchange(reader, writer, shard), self.timeout)
+            except (OSError, ValueError, asyncio.TimeoutError) as error:
+                self._fail(shard, path, error)
+            finally:
+                writer.close()
+                self._idle.put_nowait(path)
+        raise RuntimeError('Шард %d не посчитан за %d попыток: %s'
+                           % (shard.index, self.retries + 1,
+                              self.failures[-1][2]))
+
+    def _fail(self, shard: Shard, path: str, error: Exception) -> None:
+        self.failures.append((shard.index, path, repr(error)))
+
+    @staticmethod
+    async def _exchange(reader: 'asyncio.StreamReader',
+                        writer: 'asyncio.StreamWriter',
+                        shard: Shard
+                        ) -> List[InfoMessage]:
+        """Отправить шард исполнителю и прочитать его сообщения."""
+        import json
+
+        header = {'shard': shard.index, 'path': shard.path,
+                  'start': shard.start, 'end': shard.end}
+        writer.write((json.dumps(header, ensure_ascii=False) + '\n')
+                     .encode('utf-8'))
+        await writer.drain()
+        messages = []
+        async for line in reader:
+            reply = json.loads(line)
+            if isinstance(reply, list):
+                messages.append(InfoMessage(*reply))
+            elif 'error' in reply:
+                raise RuntimeError('Шард %d не посчитан: %s'
+                                   % (shard.index, reply['error']))
+            elif reply['count'] == len(messages):
+                return messages
+            else:
+                break
+        raise ConnectionError('Исполнитель не досчитал шард %d'
+                              % shard.index)
+
+
+async def _pump(source: AsyncIterator,
+                ready: 'queue.Queue[Tuple[bool, object]]',
+                credit: List['asyncio.Semaphore'],
+                window: int
+                ) -> None:
+    """Перекладывать элементы источника в очередь, не больше `window`
+    невыданных; в конце положить ошибку источника или `None`."""
+    import asyncio
+
+    credit.append(asyncio.Semaphore(window))
+    try:
+        async for item in source:
+            await credit[0].acquire()
+            ready.put((True, item))
+    except Exception as error:
+        ready.put((False, error))
+    else:
+        ready.put((False, None))
+
+
+def _drive(loop: 'asyncio.AbstractEventLoop', task: 'asyncio.Task') -> None:
+    """Крутить цикл до конца задачи, затем отменить всё оставшееся."""
+    import asyncio
+
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(task)
+    except asyncio.CancelledError:
+        pass
+    finally:
+        rest = asyncio.all_tasks(loop)
+        for other in rest:
+            other.cancel()
+        loop.run_until_complete(asyncio.gather(*rest, return_exceptions=True))
+        loop.run_until_complete(loop.shutdown_asyncgens())
+
+
+def _background_stream(source: AsyncIterator, window: int) -> Iterator:
+    """Выдавать элементы асинхронного источника в обычном генераторе.
+
+    Источник крутится в фоновом потоке со своим циклом событий и
+    уходит вперёд не больше чем на `window` невыданных элементов.
+    При закрытии генератора источник отменяется.
+    """
+    import asyncio
+    import queue
+
+    ready: 'queue.Queue[Tuple[bool, object]]' = queue.Queue()
+    credit: List['asyncio.Semaphore'] = []
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(_pump(source, ready, credit, window))
+    thread = threading.Thread(target=_drive, args=(loop, task), daemon=True)
+    thread.start()
+    try:
+        while True:
+            ok, item = ready.get()
+            if not ok:
+                if item is not None:
+                    raise item
+                return
+            loop.call_soon_threadsafe(credit[0].release)
+            yield item
+    finally:
+        loop.call_soon_threadsafe(task.cancel)
+        thread.join()
+        loop.close()
+
+
+def sharded_training_info(shards: Iterable[Shard],
+                          workers: Sequence[str],
+                          retries: int = 2,
+                          timeout: Optional[float] = None,
+                          window: Optional[int] = None
+                          ) -> Iterator[InfoMessage]:
+    """Посчитать шарды на исполнителях и выдать сообщения по порядку шардов.
+
+    Порядок не зависит от того, какой исполнитель и с какой попытки
+    посчитал шард. Шард выдаётся, как только готов он и все шарды до
+    него; следующие считаются в фоне, пока вызывающий разбирает уже
+    выданные. Вперёд уходит не больше `window` шардов, по умолчанию
+    вдвое больше, чем исполнителей.
+    """
+    coordinator = ShardCoordinator(workers, retries, timeout)
+    window = window or 2 * max(1, len(coordinator.workers))
+    for messages in _background_stream(coordinator.stream(shards, window),
+                                       window):
+        yield from messages
+
+
+def _wait_for_socket(path: str, deadline: float) -> None:
+    """Дождаться, пока исполнитель начнёт принимать соединения."""
+    import socket
+
+    while True:
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise RuntimeError('Исполнитель %s не запустился' % path)
+            time.sleep(0.01)
+        finally:
+            probe.close()
+
+
+@contextmanager
+def spawn_shard_workers(count: int,
+                        timeout: float = 10.0
+                        ) -> Iterator[List[str]]:
+    """Запустить `count` локальных исполнителей и выдать пути их сокетов.
+
+    Процессы останавливаются при выходе из блока.
+    """
+    import subprocess
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = [os.path.join(directory, 'shard-%d.sock' % index)
+                 for index in range(count)]
+        processes = [
+            subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                              '--shard-worker', path])
+            for path in paths
+        ]
+        try:
+            deadline = time.monotonic() + timeout
+            for path in paths:
+                _wait_for_socket(path, deadline)
+            yield paths
+        finally:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.wait()
+
+
+# Верхние границы корзин гистограммы времени этапа, секунды.
+HISTOGRAM_BUCKETS: Tuple[float, ...] = (
+    1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 1e-3, 1e-2, 0.1, 1.0,
+)
+
+
+@dataclass
+class StageStats:
+    """Счётчик вызовов и гистограмма времени одного этапа."""
+    count: int = 0
+    total: float = 0.0
+    buckets: List[int] = field(
+        default_factory=lambda: [0] * (len(HISTOGRAM_BUCKETS) + 1))
+
+    def observe(self, seconds: float) -> None:
+        """Учесть один вызов длительностью `seconds`."""
+        self.count += 1
+        self.total += seconds
+        self.buckets[bisect_left(HISTOGRAM_BUCKETS, seconds)] += 1
+
+
+class Instrumentation:
+    """Замеры этапов обработки пакетов в текущем процессе.
+
+    Пока замеры выключены, функции модуля не обёрнуты и ничего не
+    стоят. `enable` подменяет `read_package`, `show_training_info`,
+    формулу калорий каждого вида тренировки, `get_message` и сборку
+    текста пачки в `format_messages` и `format_results` обёртками с
+    таймером, `disable` возвращает оригиналы. Замеряется только
+    текущий процесс: процессы `--workers` и исполнители шардов в
+    замеры не попадают.
+    """
+
+    def __init__(self) -> None:
+        self.stages: Dict[str, StageStats] = {}
+        self.profiler: Optional[Callable[[str], ContextManager]] = None
+        self._originals: List[Tuple[object, str, Callable]] = []
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._originals)
+
+    def _targets(self) -> List[Tuple[object, str, str]]:
+        """Что оборачивать: владелец, атрибут и имя этапа."""
+        module = sys.modules[__name__]
+        targets = [(module, 'read_package', 'read_package'),
+                   (Training, 'show_training_info', 'show_training_info'),
+                   (InfoMessage, 'get_message', 'get_message'),
+                   (module, 'format_messages', 'format_messages'),
+                   (module, 'format_results', 'format_results')]
+        for training_class in TRAINING_TYPES.values():
+            for name in ('spent_calories', 'get_spent_calories'):
+                if name in vars(training_class):
+                    targets.append((training_class, name,
+                                    '%s.get_spent_calories'
+                                    % training_class.__name__))
+        return targets
+
+    def _timed(self, stage: str, function: Callable) -> Callable:
+        stats = self.stages.setdefault(stage, StageStats())
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stats.observe(time.perf_counter() - start)
+        return wrapper
+
+    def enable(self) -> None:
+        """Включить замеры."""
+        if self.enabled:
+            return
+        for owner, name, stage in self._targets():
+            original = getattr(owner, name)
+            self._originals.append((owner, name, original))
+            setattr(owner, name, self._timed(stage, original))
+
+    def disable(self) -> None:
+        """Выключить замеры, сохранив накопленное."""
+        while self._originals:
+            owner, name, original = self._originals.pop()
+            setattr(owner, name, original)
+
+    def reset(self) -> None:
+        """Обнулить накопленные замеры."""
+        for stats in self.stages.values():
+            stats.count, stats.total = 0, 0.0
+            stats.buckets[:] = [0] * len(stats.buckets)
+
+    @contextmanager
+    def batch(self, name: str = 'batch') -> Iterator[None]:
+        """Замерить пачку целиком, запустив для неё `profiler`, если задан.
+
+        `profiler` получает имя пачки и возвращает контекстный
+        менеджер, например `cprofile_batches(directory)`.
+        """
+        stats = self.stages.setdefault(name, StageStats())
+        profiler = self.profiler(name) if self.profiler else nullcontext()
+        start = time.perf_counter()
+        try:
+            with profiler:
+                yield
+        finally:
+            stats.observe(time.perf_counter() - start)
+
+    def snapshot(self) -> Dict[str, dict]:
+        """Вернуть замеры словарём по этапам."""
+        return {stage: asdict(stats) for stage, stats in self.stages.items()}
+
+    def prometheus(self) -> str:
+        """Вернуть замеры в текстовом формате Prometheus."""
+        lines = ['# TYPE homework_stage_seconds histogram']
+        bounds = [repr(bound) for bound in HISTOGRAM_BUCKETS] + ['+Inf']
+        for stage, stats in self.stages.items():
+            cumulative = 0
+            for bound, hits in zip(bounds, stats.buckets):
+                cumulative += hits
+                lines.append('homework_stage_seconds_bucket'
+                             '{stage="%s",le="%s"} %d'
+                             % (stage, bound, cumulative))
+            lines.append('homework_stage_seconds_sum{stage="%s"} %r'
+                         % (stage, stats.total))
+            lines.append('homework_stage_seconds_count{stage="%s"} %d'
+                         % (stage, stats.count))
+        return '\n'.join(lines) + '\n'
+
+
+def cprofile_batches(directory: str) -> Callable[[str], ContextManager]:
+    """Профилировать каждую пачку cProfile в `directory/<имя>-<N>.prof`."""
+    numbers = count()
+
+    @contextmanager
+    def profile(name: str) -> Iterator[None]:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(os.path.join(
+                directory, '%s-%d.prof' % (name, next(numbers))))
+    return profile
+
+
+instrumentation = Instrumentation()
+
+
+class OutputSink:
+    """Буферизованный вывод текста одним `write` на пачку строк.
+
+    Буфер сбрасывается, когда в нём набралось `buffer_size` символов,
+    `flush_lines` строк или прошло `flush_interval` секунд с прошлого
+    сброса. Писать можно из нескольких потоков.
+    """
+
+    def __init__(self,
+                 stream: TextIO,
+                 buffer_size: int = 1 << 16,
+                 flush_lines: Optional[int] = None,
+                 flush_interval: Optional[float] = None,
+                 close_stream: bool = True
+                 ) -> None:
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.flush_lines = flush_lines
+        self.flush_interval = flush_interval
+        self.close_stream = close_stream
+        self._buffer: List[str] = []
+        self._size = 0
+        self._lines = 0
+        self._flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> 'OutputSink':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _due(self) -> bool:
+        """Пора ли сбросить буфер по политике сброса."""
+        return (self._size >= self.buffer_size
+                or (self.flush_lines is not None
+                    and self._lines >= self.flush_lines)
+                or (self.flush_interval is not None
+                    and time.monotonic() - self._flushed_at
+                    >= self.flush_interval))
+
+    def write(self, text: str) -> int:
+        """Добавить текст в буфер, сбросив его по политике."""
+        with self._lock:
+            self._buffer.append(text)
+            self._size += len(text)
+            self._lines += text.count('\n')
+            if self._due():
+                self._flush_locked()
+        return len(text)
+
+    def write_messages(self, messages: Iterable[InfoMessage]) -> int:
+        """Записать сообщения по одному на строку."""
+        return write_messages(messages, self)
+
+    def write_texts(self, texts: Iterable[str]) -> int:
+        """Записать готовые тексты сообщений по одному на строку."""
+        return write_texts(texts, self)
+
+    def write_batch(self, batch: TrainingBatch) -> int:
+        """Записать результаты пакетного расчёта по одному на строку."""
+        return write_batch(batch, self)
+
+    def flush(self) -> None:
+        """Сбросить буфер в поток."""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        if self._buffer:
+            self._emit(''.join(self._buffer))
+            self._buffer.clear()
+        self._size = self._lines = 0
+        self._flushed_at = time.monotonic()
+
+    def _emit(self, text: str) -> None:
+        """Записать пачку текста в поток."""
+        self.stream.write(text)
+        self.stream.flush()
+
+    def close(self) -> None:
+        """Сбросить буфер и закрыть поток."""
+        self.flush()
+        if self.close_stream:
+            self.stream.close()
+
+
+class ThreadedSink(OutputSink):
+    """`OutputSink`, пишущий пачки в отдельном потоке.
+
+    Пока поток пишет одну пачку, вызывающий код форматирует следующую.
+    Очередь ограничена `max_pending` пачками: если запись отстаёт,
+    `write` ждёт. Ошибка записи поднимается в следующем `write` или
+    в `close`.
+    """
+
+    def __init__(self, stream: TextIO, max_pending: int = 8,
+                 **policy) -> None:
+        import queue
+
+        super().__init__(stream, **policy)
+        self._queue: 'queue.Queue[Optional[str]]' = queue.Queue(max_pending)
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._writer, daemon=True)
+        self._thread.start()
+
+    def _writer(self) -> None:
+        while True:
+            text = self._queue.get()
+            if text is None:
+                return
+            try:
+                if self._error is None:
+                    super()._emit(text)
+            except BaseException as error:
+                self._error = error
+
+    def _emit(self, text: str) -> None:
+        if self._error is not None:
+            raise self._error
+        self._queue.put(text)
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        finally:
+            self._queue.put(None)
+            self._thread.join()
+            if self.close_stream:
+                self.stream.close()
+        if self._error is not None:
+            raise self._error
+
+
+def _open_compressed(path: str, compression: Optional[str]) -> TextIO:
+    """Открыть файл на запись текста, сжимая его при необходимости."""
+    if compression is None:
+        if path.endswith('.gz'):
+            compression = 'gzip'
+        elif path.endswith('.zst'):
+            compression = 'zstd'
+    if compression == 'gzip':
+        import gzip
+
+        return gzip.open(path, 'wt', encoding='utf-8')
+    if compression == 'zstd':
+        try:
+            from compression import zstd
+        except ImportError:
+            raise ValueError('Сжатие zstd требует Python 3.14 и новее.')
+        return zstd.open(path, 'wt', encoding='utf-8')
+    if compression is not None:
+        raise ValueError('Неизвестное сжатие: %r' % compression)
+    return open(path, 'w', encoding='utf-8')
+
+
+def open_sink(path: Optional[str] = None,
+              compression: Optional[str] = None,
+              threaded: bool = False,
+              **policy) -> OutputSink:
+    """Открыть вывод в файл или, без `path` или с `-`, в stdout.
+
+    Сжатие `gzip` или `zstd` выбирается явно или по расширению
+    `.gz`/`.zst`. Остальные параметры — политика сброса `OutputSink`.
+    """
+    if path is None or path == '-':
+        stream, policy['close_stream'] = sys.stdout, False
+    else:
+        stream = _open_compressed(path, compression)
+    sink_class = ThreadedSink if threaded else OutputSink
+    return sink_class(stream, **policy)
+
+
+RESULT_FIELDS: Tuple[str, ...] = ('training_type', 'duration', 'distance',
+                                  'speed', 'calories')
+
+
+class ResultWriter:
+    """Потоковая запись результатов по полям, без текста сообщений.
+
+    Результаты пишутся кусками по `chunk_size`, так что в памяти
+    одновременно не больше одного куска.
+    """
+
+    def __init__(self, path: str, chunk_size: int = 65536) -> None:
+        self.path = path
+        self.chunk_size = chunk_size
+
+    def __enter__(self) -> 'ResultWriter':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def write_rows(self, rows: List[tuple]) -> None:
+        """Записать кусок строк `RESULT_FIELDS`."""
+        raise NotImplementedError('Определите write_rows в %s.'
+                                  % (type(self).__name__))
+
+    def close(self) -> None:
+        """Дописать и закрыть файл."""
+
+    def write_messages(self, messages: Iterable[InfoMessage]) -> int:
+        """Записать сообщения о тренировках."""
+        rows = ((info.training_type, info.duration, info.distance,
+                 info.speed, info.calories) for info in messages)
+        written = 0
+        for chunk in chunked(rows, self.chunk_size):
+            self.write_rows(chunk)
+            written += len(chunk)
+        return written
+
+    def write_batch(self, batch: TrainingBatch) -> int:
+        """Записать результаты пакетного расчёта."""
+        training_type = batch.training_type
+        columns = [_as_list(column) for column in (batch.duration,
+                                                   batch.distance,
+                                                   batch.speed,
+                                                   batch.calories)]
+        for chunk in chunked(zip(*columns), self.chunk_size):
+            self.write_rows([(training_type, *row) for row in chunk])
+        return len(batch)
+
+
+class CsvResultWriter(ResultWriter):
+    """Результаты в CSV с заголовком."""
+
+    def __init__(self, path: str, chunk_size: int = 65536) -> None:
+        import csv
+
+        super().__init__(path, chunk_size)
+        self._file = open(path, 'w', encoding='utf-8', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(RESULT_FIELDS)
+
+    def write_rows(self, rows: List[tuple]) -> None:
+        self._writer.writerows(rows)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class JsonlResultWriter(ResultWriter):
+    """Результаты в JSON Lines, объект на строку."""
+
+    def __init__(self, path: str, chunk_size: int = 65536) -> None:
+        super().__init__(path, chunk_size)
+        self._file = open(path, 'w', encoding='utf-8')
+
+    def write_rows(self, rows: List[tuple]) -> None:
+        import json
+
+        self._file.write(''.join([
+            json.dumps(dict(zip(RESULT_FIELDS, row)), ensure_ascii=False)
+            + '\n' for row in rows
+        ]))
+
+    def close(self) -> None:
+        self._file.close()
+
+
+# Колоночный формат результатов без сторонних библиотек. Кусок —
+# блок: заголовок (сигнатура, версия, число строк, число видов),
+# словарь видов тренировок как строки UTF-8 с длиной, коды видов
+# uint16 по строкам и четыре колонки float64 little-endian:
+# duration, distance, speed, calories. Колонки выровнены по 8 байт.
+RESULT_MAGIC = b'HWRS'
+RESULT_VERSION = 1
+RESULT_HEADER = struct.Struct('<4sB3xII')
+TYPE_LENGTH = struct.Struct('<H')
+
+
+def _padding(size: int) -> bytes:
+    return bytes(-size % 8)
+
+
+class ColumnarResultWriter(ResultWriter):
+    """Результаты в колоночном формате `HWRS`, см. `read_results`."""
+
+    def __init__(self, path: str, chunk_size: int = 65536) -> None:
+        super().__init__(path, chunk_size)
+        self._file = open(path, 'wb')
+
+    def write_rows(self, rows: List[tuple]) -> None:
+        types: Dict[str, int] = {}
+        codes = array('H', [types.setdefault(row[0], len(types))
+                            for row in rows])
+        dictionary = b''.join(TYPE_LENGTH.pack(len(encoded)) + encoded
+                              for encoded in (training_type.encode('utf-8')
+                                              for training_type in types))
+        parts = [RESULT_HEADER.pack(RESULT_MAGIC, RESULT_VERSION,
+                                    len(rows), len(types)),
+                 dictionary, _padding(len(dictionary)),
+                 _little_endian(codes), _padding(2 * len(codes))]
+        for index in range(1, len(RESULT_FIELDS)):
+            parts.append(_little_endian(array('d', [row[index]
+                                                    for row in rows])))
+        self._file.write(b''.join(parts))
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def _little_endian(column: array) -> bytes:
+    """Байты колонки в порядке little-endian."""
+    if sys.byteorder == 'big':
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+def read_results(path: str) -> Iterator[Dict[str, Sequence]]:
+    """Читать блоки колоночного файла результатов через mmap.
+
+    Числовые колонки — представления над отображённым файлом,
+    `training_type` — список строк.
+    """
+    with open(path, 'rb') as file:
+        if not os.fstat(file.fileno()).st_size:
+            return
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    offset = 0
+    while offset < len(buffer):
+        magic, version, rows, type_count = RESULT_HEADER.unpack_from(
+            buffer, offset)
+        if magic != RESULT_MAGIC or version != RESULT_VERSION:
+            raise ValueError('%s: неизвестный блок по смещению %d'
+                             % (path, offset))
+        offset += RESULT_HEADER.size
+        start, types = offset, []
+        for _ in range(type_count):
+            (length,) = TYPE_LENGTH.unpack_from(buffer, offset)
+            offset += TYPE_LENGTH.size
+            types.append(bytes(buffer[offset:offset + length]).decode())
+            offset += length
+        offset += -(offset - start) % 8
+        codes = array('H', buffer[offset:offset + 2 * rows])
+        if sys.byteorder == 'big':
+            codes.byteswap()
+        offset += 2 * rows + -(2 * rows) % 8
+        if offset + 8 * rows * (len(RESULT_FIELDS) - 1) > len(buffer):
+            raise ValueError('%s: блок обрезан' % path)
+        block: Dict[str, Sequence] = {
+            'training_type': [types[code] for code in codes]
+        }
+        for name in RESULT_FIELDS[1:]:
+            block[name] = _column_view(buffer, offset, rows)
+            offset += 8 * rows
+        yield block
+
+
+class ParquetResultWriter(ResultWriter):
+    """Результаты в Parquet через pyarrow, группа строк на кусок."""
+
+    def __init__(self, path: str, chunk_size: int = 65536) -> None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ValueError('Для Parquet установите pyarrow или выберите '
+                             'формат columnar.')
+        super().__init__(path, chunk_size)
+        self._pyarrow = pyarrow
+        self._schema = pyarrow.schema(
+            [('training_type', pyarrow.string())]
+            + [(name, pyarrow.float64()) for name in RESULT_FIELDS[1:]])
+        self._writer = pyarrow.parquet.ParquetWriter(path, self._schema)
+
+    def write_rows(self, rows: List[tuple]) -> None:
+        columns = [self._pyarrow.array([row[index] for row in rows],
+                                       type=field_type)
+                   for index, field_type in enumerate(self._schema.types)]
+        self._writer.write_batch(self._pyarrow.record_batch(
+            columns, schema=self._schema))
+
+    def close(self) -> None:
+        self._writer.close()
+
+
+RESULT_WRITERS: Dict[str, Type[ResultWriter]] = {
+    'csv': CsvResultWriter,
+    'jsonl': JsonlResultWriter,
+    'columnar': ColumnarResultWriter,
+    'parquet': ParquetResultWriter,
+}
+RESULT_SUFFIXES: Dict[str, str] = {
+    '.csv': 'csv',
+    '.jsonl': 'jsonl',
+    '.hwr': 'columnar',
+    '.parquet': 'parquet',
+}
+
+
+def open_result_writer(path: str,
+                       export_format: Optional[str] = None,
+                       chunk_size: int = 65536
+                       ) -> ResultWriter:
+    """Открыть запись результатов; формат по умолчанию — по расширению."""
+    if export_format is None:
+        export_format = RESULT_SUFFIXES.get(os.path.splitext(path)[1])
     try:
-        return (training_type[workout_type](*data))
+        writer_class = RESULT_WRITERS[export_format]
     except KeyError:
-        raise ValueError(*training_type, ' - Доступные типы тренировки')
+        raise ValueError(*RESULT_WRITERS, ' - Доступные форматы выгрузки')
+    return writer_class(path, chunk_size)
+
+
+# Оценка памяти на одно сообщение при сортировке в памяти: объект
+# `InfoMessage`, его числа, ключ сортировки и место в списке, байты.
+MESSAGE_BYTES = 256
+# Сколько отсортированных отрезков сливается за один проход.
+MERGE_FAN_IN = 64
+
+
+def _read_run(path: str) -> Iterator[InfoMessage]:
+    """Читать сообщения отрезка, сброшенного на диск, поблочно."""
+    for block in read_results(path):
+        columns = [block['training_type']] + [_as_list(block[name])
+                                              for name in RESULT_FIELDS[1:]]
+        for row in zip(*columns):
+            yield InfoMessage(*row)
+
+
+def _spill(messages: Iterable[InfoMessage],
+           directory: str,
+           chunk_size: int
+           ) -> str:
+    """Сбросить сообщения во временный файл формата `HWRS`."""
+    import tempfile
+
+    descriptor, path = tempfile.mkstemp(suffix='.hwr', dir=directory)
+    os.close(descriptor)
+    with ColumnarResultWriter(path, chunk_size) as writer:
+        writer.write_messages(messages)
+    return path
+
+
+def external_sort(messages: Iterable[InfoMessage],
+                  key: Callable[[InfoMessage], object] = attrgetter(
+                      'training_type', 'calories'),
+                  memory_budget: int = 64 << 20,
+                  directory: Optional[str] = None
+                  ) -> Iterator[InfoMessage]:
+    """Отсортировать поток сообщений, держа в памяти не больше бюджета.
+
+    Вход читается отрезками на `memory_budget` байт (по оценке
+    `MESSAGE_BYTES` на сообщение). Отрезок сортируется в памяти и
+    сбрасывается во временный файл в `directory`, затем отрезки
+    сливаются по `MERGE_FAN_IN` за проход и читаются блоками, так что
+    память не растёт с размером входа. Сортировка устойчивая, по
+    умолчанию — по виду тренировки и калориям. Если вход уместился
+    в один отрезок, диск не используется.
+    """
+    import heapq
+    import tempfile
+
+    run_size = max(1, memory_budget // MESSAGE_BYTES)
+    chunk_size = max(1, run_size // MERGE_FAN_IN)
+    runs = chunked(messages, run_size)
+    run = next(runs, [])
+    if len(run) < run_size:
+        run.sort(key=key)
+        yield from run
+        return
+    with tempfile.TemporaryDirectory(dir=directory) as spill:
+        paths = []
+        while run:
+            run.sort(key=key)
+            paths.append(_spill(run, spill, chunk_size))
+            run.clear()
+            run = next(runs, [])
+        while len(paths) > MERGE_FAN_IN:
+            merged = []
+            for group in chunked(paths, MERGE_FAN_IN):
+                merged.append(_spill(
+                    heapq.merge(*map(_read_run, group), key=key),
+                    spill, chunk_size))
+                for path in group:
+                    os.remove(path)
+            paths = merged
+        yield from heapq.merge(*map(_read_run, paths), key=key)
+
+
+def external_group_by(messages: Iterable[InfoMessage],
+                      key: Callable[[InfoMessage], object] = attrgetter(
+                          'training_type'),
+                      memory_budget: int = 64 << 20,
+                      directory: Optional[str] = None
+                      ) -> Iterator[Tuple[object, WindowTotals]]:
+    """Выдать итоги групп сообщений по возрастанию ключа.
 
+    Сообщения сортируются `external_sort` по `key`, поэтому группы
+    идут подряд и в памяти держатся только итоги текущей группы.
+    """
+    from itertools import groupby
 
-def main(training: Training) -> None:
+    for group, items in groupby(external_sort(messages, key, memory_budget,
+                                              directory), key):
+        totals = WindowTotals()
+        for info in items:
+            totals.add(info)
+        yield group, totals
+
+
+def main(training: Training,
+         sink: Optional[Union[OutputSink, ResultWriter]] = None
+         ) -> None:
     """Главная функция."""
     info = training.show_training_info()
-    print(info.get_message())
+    if sink is None:
+        print(info.get_message())
+    else:
+        sink.write_messages([info])
 
 
-if __name__ == '__main__':
+def run(argv: Optional[List[str]] = None) -> None:
+    """Запустить трекер из командной строки."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Модуль фитнес-трекера')
+    parser.add_argument('inputs', nargs='*',
+                        help='файлы с пакетами по одному на строку, '
+                             '`-` — стандартный ввод')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='число процессов, 0 — по числу ядер')
+    parser.add_argument('--chunk-size', type=int, default=1000,
+                        help='число пакетов в куске для процесса')
+    parser.add_argument('--unordered', action='store_true',
+                        help='не сохранять порядок входа в выводе')
+    parser.add_argument('--cache-size', type=int, default=0,
+                        help='размер кеша повторных пакетов, 0 — без кеша')
+    parser.add_argument('--serve', metavar='HOST:PORT',
+                        help='принимать пакеты по TCP')
+    parser.add_argument('--unix', metavar='PATH',
+                        help='принимать пакеты через Unix-сокет')
+    parser.add_argument('--max-connections', type=int, default=1024,
+                        help='число одновременно обслуживаемых соединений')
+    parser.add_argument('--json', action='store_true',
+                        help='отвечать серверу JSON вместо текста')
+    parser.add_argument('--metrics', metavar='PATH',
+                        help='записать замеры этапов в формате Prometheus')
+    parser.add_argument('--profile', metavar='DIR',
+                        help='сохранить профиль cProfile прогона')
+    parser.add_argument('--binary', action='store_true',
+                        help='входные файлы в двоичном формате')
+    parser.add_argument('--threads', type=int, default=1,
+                        help='число потоков для двоичных файлов, '
+                             '0 — по числу ядер')
+    parser.add_argument('--to-binary', metavar='PATH',
+                        help='перевести входные пакеты в двоичный формат')
+    parser.add_argument('--output', metavar='PATH',
+                        help='файл для сообщений, по умолчанию stdout')
+    parser.add_argument('--compress', choices=['gzip', 'zstd'],
+                        help='сжатие файла вывода')
+    parser.add_argument('--flush-lines', type=int,
+                        help='сбрасывать вывод каждые N строк')
+    parser.add_argument('--threaded-output', action='store_true',
+                        help='писать вывод в отдельном потоке')
+    parser.add_argument('--export', metavar='PATH',
+                        help='выгрузить результаты по полям вместо текста')
+    parser.add_argument('--export-format', choices=list(RESULT_WRITERS),
+                        help='формат выгрузки, по умолчанию по расширению')
+    parser.add_argument('--dead-letter', metavar='PATH',
+                        help='проверять пакеты и писать плохие в JSON Lines, '
+                             '`-` — stderr')
+    parser.add_argument('--sort', action='store_true',
+                        help='выводить результаты по виду тренировки и '
+                             'калориям')
+    parser.add_argument('--memory-budget', type=int, default=64,
+                        help='память на сортировку в МиБ, остальное '
+                             'сбрасывается на диск')
+    parser.add_argument('--shards', type=int, default=0,
+                        help='считать вход шардами на исполнителях')
+    parser.add_argument('--shard-by', choices=['range', 'athlete'],
+                        default='range',
+                        help='резать файлы по байтам или по спортсменам')
+    parser.add_argument('--worker-socket', metavar='PATH', action='append',
+                        help='сокет запущенного исполнителя шардов, без '
+                             'него запускается --workers исполнителей')
+    parser.add_argument('--shard-worker', metavar='PATH',
+                        help='работать исполнителем шардов на Unix-сокете')
+    args = parser.parse_args(argv)
+    if args.dead_letter and (args.workers != 1 or args.shards):
+        parser.error('--dead-letter работает только с --workers 1')
+    if args.shards and args.shard_by == 'range' and '-' in args.inputs:
+        parser.error('стандартный ввод режется только --shard-by athlete')
+    if (args.metrics or args.profile) and (args.workers != 1
+                                           or args.shards):
+        parser.error('--metrics и --profile замеряют только текущий '
+                     'процесс, уберите --workers и --shards')
+    if args.metrics or args.profile:
+        _run_instrumented(args)
+        return
+    _dispatch(args)
+
+
+def _run_instrumented(args: 'argparse.Namespace') -> None:
+    """Выполнить команду с замерами этапов и/или профилем."""
+    instrumentation.enable()
+    if args.profile:
+        instrumentation.profiler = cprofile_batches(args.profile)
+    try:
+        with instrumentation.batch('run'):
+            _dispatch(args)
+    finally:
+        instrumentation.disable()
+        if args.metrics:
+            with open(args.metrics, 'w', encoding='utf-8') as file:
+                file.write(instrumentation.prometheus())
+
+
+def _dispatch(args: 'argparse.Namespace') -> None:
+    """Выполнить команду, выбранную аргументами."""
+    if args.shard_worker:
+        import asyncio
+
+        asyncio.run(serve_shards(args.shard_worker))
+        return
+    if args.serve or args.unix:
+        import asyncio
+
+        host, _, port = (args.serve or '').rpartition(':')
+        asyncio.run(serve(host=host or None,
+                          port=int(port) if port else None,
+                          path=args.unix,
+                          max_connections=args.max_connections,
+                          structured=args.json,
+                          cache_size=args.cache_size))
+        return
+    if args.to_binary:
+        with open(args.to_binary, 'wb') as file:
+            write_binary(read_packets(read_lines(args.inputs)), file)
+        return
+    if args.export:
+        with open_result_writer(args.export, args.export_format) as writer:
+            _process(args, writer)
+        return
+    with open_sink(args.output, args.compress, args.threaded_output,
+                   flush_lines=args.flush_lines) as sink:
+        _process(args, sink)
+
+
+def _process(args: 'argparse.Namespace',
+             sink: Union[OutputSink, ResultWriter]
+             ) -> None:
+    """Обработать входные пакеты, записывая результаты в `sink`."""
+    if args.binary:
+        _process_binary(args, sink)
+        return
+    if args.dead_letter:
+        with _open_dead_letter(args.dead_letter) as dead_letter:
+            _process_packets(args, sink, dead_letter)
+    else:
+        _process_packets(args, sink, None)
+
+
+def _process_binary(args: 'argparse.Namespace',
+                    sink: Union[OutputSink, ResultWriter]
+                    ) -> None:
+    """Обработать двоичные файлы пакетов.
+
+    Без проверки и сортировки результаты пишутся колонками, блок за
+    блоком; иначе — по сообщениям.
+    """
+    executor = (BatchExecutor(args.threads or None)
+                if args.threads != 1 else None)
+    dead_letter = (_open_dead_letter(args.dead_letter) if args.dead_letter
+                   else nullcontext())
+    with executor or nullcontext(), dead_letter as dead_letter:
+        if dead_letter is None and not args.sort:
+            for path in args.inputs:
+                for batch in read_binary(path, executor):
+                    sink.write_batch(batch)
+            return
+        messages = _binary_messages(args.inputs, executor, dead_letter)
+        if args.sort:
+            messages = external_sort(messages,
+                                     memory_budget=args.memory_budget << 20)
+        sink.write_messages(messages)
+
+
+def _binary_messages(paths: Sequence[str],
+                     executor: Optional[BatchExecutor],
+                     dead_letter: Optional[TextIO]
+                     ) -> Iterator[InfoMessage]:
+    """Сообщения двоичных файлов, с проверкой, если задан `dead_letter`."""
+    for path in paths:
+        if dead_letter is not None:
+            yield from validated_binary(path, dead_letter)
+        else:
+            for batch in read_binary(path, executor):
+                yield from batch_messages(batch)
+
+
+@contextmanager
+def _open_dead_letter(path: str) -> Iterator[TextIO]:
+    """Открыть вывод отклонённых пакетов, `-` — stderr."""
+    if path == '-':
+        yield sys.stderr
+        return
+    with open(path, 'w', encoding='utf-8') as file:
+        yield file
+
+
+def _process_packets(args: 'argparse.Namespace',
+                     sink: Union[OutputSink, ResultWriter],
+                     dead_letter: Optional[TextIO]
+                     ) -> None:
+    """Обработать текстовые пакеты или, без входных файлов, демо-набор."""
+    cache = ResultCache(args.cache_size) if args.cache_size else None
+    if args.inputs:
+        lines = read_lines(args.inputs)
+        if dead_letter is not None:
+            messages = validated_training_info(lines, dead_letter,
+                                               args.chunk_size, cache)
+        elif args.shards:
+            messages = _sharded_messages(args)
+        elif args.workers == 1 and cache is not None and not args.sort and (
+                isinstance(sink, OutputSink)):
+            sink.write_texts(stream_training_text(lines, cache))
+            return
+        elif args.workers == 1:
+            messages = stream_training_info(lines, cache)
+        else:
+            messages = parallel_training_info(lines,
+                                              args.workers or None,
+                                              args.chunk_size,
+                                              not args.unordered,
+                                              args.cache_size)
+        if args.sort:
+            messages = external_sort(messages,
+                                     memory_budget=args.memory_budget << 20)
+        sink.write_messages(messages)
+        return
+
     packages = [
         ('SWM', [720, 1, 80, 25, 40]),
         ('RUN', [15000, 1, 75]),
         ('WLK', [9000, 1, 75, 180]),
         ('SQT', [9210, 5, 85, 160]),
     ]
+    if dead_letter is not None:
+        packages, rejected = validate_packets(packages)
+        write_rejected(rejected, dead_letter)
 
     for workout_type, data in packages:
         training = read_package(workout_type, data)
-        main(training)
+        main(training, sink)
+
+
+def _sharded_messages(args: 'argparse.Namespace') -> Iterator[InfoMessage]:
+    """Посчитать входные файлы шардами на исполнителях из аргументов."""
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.shard_by == 'range':
+            shards = shard_by_range(args.inputs, args.shards)
+        else:
+            shards = shard_by_athlete(read_lines(args.inputs), args.shards,
+                                      directory)
+        if args.worker_socket:
+            workers = nullcontext(args.worker_socket)
+        else:
+            workers = spawn_shard_workers(
+                args.workers or os.cpu_count() or 1)
+        with workers as paths:
+            yield from sharded_training_info(shards, paths)
+
+
+if __name__ == '__main__':
+    run()
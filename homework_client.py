@@ -0,0 +1,77 @@
+"""Лёгкий запуск фитнес-трекера для коротких вызовов.
+
+Импортирует только стандартные модули, нужные для сокета: пакеты
+уходят демону, запущенному как `python homework.py --unix PATH`,
+и его ответы печатаются как есть. Если демон не запущен, пакеты
+обрабатываются на месте через `homework`.
+
+    python homework_client.py [--socket PATH] [файлы...]
+"""
+import os
+import socket
+import sys
+import threading
+
+DEFAULT_SOCKET = os.environ.get('HOMEWORK_SOCKET', '/tmp/homework.sock')
+
+
+def _read_input(paths):
+    """Прочитать входные файлы целиком, `-` или без файлов — stdin."""
+    chunks = []
+    for path in paths or ['-']:
+        if path == '-':
+            chunks.append(sys.stdin.buffer.read())
+        else:
+            with open(path, 'rb') as file:
+                chunks.append(file.read())
+    return b''.join(chunks)
+
+
+def send(data, path=DEFAULT_SOCKET, output=None):
+    """Отправить пакеты демону и переписать его ответы в `output`.
+
+    Пакеты отправляются в отдельном потоке, чтобы демон мог отвечать,
+    не дожидаясь конца ввода.
+    """
+    output = output or sys.stdout.buffer
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+
+        def sender():
+            client.sendall(data)
+            client.shutdown(socket.SHUT_WR)
+        thread = threading.Thread(target=sender, daemon=True)
+        thread.start()
+        while True:
+            chunk = client.recv(1 << 16)
+            if not chunk:
+                break
+            output.write(chunk)
+        thread.join()
+    finally:
+        client.close()
+    output.flush()
+
+
+def run(argv=None):
+    """Отдать пакеты демону, а без демона — обработать так же на месте."""
+    argv = sys.argv[1:] if argv is None else list(argv)
+    path = DEFAULT_SOCKET
+    if argv[:1] == ['--socket']:
+        path, argv = argv[1], argv[2:]
+    data = _read_input(argv)
+    try:
+        send(data, path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        import homework
+
+        # Строки режутся по b'\n' и декодируются по одной, как у демона:
+        # не UTF-8 строка получает ответ с ошибкой, а не роняет запуск.
+        sys.stdout.writelines(
+            homework.format_reply(line, False, None) + '\n'
+            for line in data.split(b'\n') if line.strip())
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,104 @@
+import json
+
+import pytest
+
+import benchmarks
+import homework
+
+
+def test_measure_memory():
+    result = benchmarks.measure_memory(1000)
+    assert result['training_store'] < result['training_objects'] / 2, (
+        '`TrainingStore` должен занимать заметно меньше памяти, '
+        'чем список объектов.'
+    )
+
+
+def test_measure_rendering():
+    result = benchmarks.measure_rendering(100)
+    assert set(result) == {'get_message', 'write_messages', 'write_batch'}
+    assert all(rate > 0 for rate in result.values())
+
+
+@pytest.mark.parametrize('workout_type', ['SWM', 'RUN', 'WLK'])
+def test_generate_packets(workout_type):
+    packets = list(benchmarks.generate_packets(workout_type, 50, seed=1))
+    assert packets == list(benchmarks.generate_packets(workout_type, 50,
+                                                       seed=1))
+    for packet in packets:
+        homework.read_package(*packet).show_training_info()
+
+
+def test_run_suite():
+    report = benchmarks.run_suite([30], ['RUN'])
+    stages = report['results']['30']['RUN']
+    assert set(stages) == set(benchmarks.STAGES)
+    for result in stages.values():
+        assert result['throughput'] > 0
+        assert result['p50_us'] <= result['p90_us'] <= result['p99_us']
+    assert benchmarks.compare(report, report) == []
+
+
+def test_measure_stage_no_packets():
+    result = benchmarks.measure_stage('read_package', 'RUN', 0)
+    assert result == {'throughput': 0.0, 'p50_us': 0.0, 'p90_us': 0.0,
+                      'p99_us': 0.0}
+
+
+def test_compare_regressions():
+    baseline = {'results': {'10': {'RUN': {'main': {
+        'throughput': 1000.0, 'p50_us': 1.0, 'p90_us': 1.0, 'p99_us': 1.0,
+    }}}}}
+    report = {'results': {'10': {'RUN': {'main': {
+        'throughput': 700.0, 'p50_us': 1.5, 'p90_us': 1.0, 'p99_us': 1.0,
+    }}}}}
+    assert len(benchmarks.compare(report, baseline, tolerance=0.2)) == 2
+    assert benchmarks.compare(report, baseline, tolerance=0.6) == []
+
+
+def test_run_fails_on_regression(tmp_path):
+    baseline = tmp_path / 'baseline.json'
+    benchmarks.run(['--packets', '20', '--types', 'WLK',
+                    '--output', str(baseline)])
+    report = json.loads(baseline.read_text(encoding='utf-8'))
+    for stage in report['results']['20']['WLK'].values():
+        stage['throughput'] *= 1000
+    baseline.write_text(json.dumps(report), encoding='utf-8')
+    with pytest.raises(SystemExit) as error:
+        benchmarks.run(['--packets', '20', '--types', 'WLK',
+                        '--output', str(tmp_path / 'report.json'),
+                        '--baseline', str(baseline)])
+    assert 'WLK' in str(error.value)
+
+
+def test_measure_startup():
+    heavy = {'numpy', 'asyncio', 'concurrent.futures', 'argparse', 'json'}
+    startup = benchmarks.measure_startup('homework')
+    assert startup['total_us'] > 0
+    assert not heavy & set(startup['modules']), (
+        'Импорт `homework` не должен тянуть модули отдельных режимов.'
+    )
+    client = benchmarks.measure_startup('homework_client')
+    assert not ({'homework', 'dataclasses', 'typing'} | heavy) & set(
+        client['modules']
+    ), '`homework_client` должен импортировать только модули для сокета.'
+
+
+def test_measure_sensor():
+    result = benchmarks.measure_sensor(20000, athletes=10)
+    assert result['laps'] > 0
+    assert result['samples_per_second'] > 1000, (
+        'Разбор отсчётов должен успевать за тысячами отсчётов в секунду.'
+    )
+
+
+def test_measure_threads():
+    result = benchmarks.measure_threads(5000, 3, repeat=1)
+    assert set(result['records_per_second']) == {'1', '2', '3'}
+    assert all(rate > 0 for rate in result['records_per_second'].values())
+
+
+def test_measure_metrics():
+    result = benchmarks.measure_metrics(300)
+    assert set(result) == {'getters', 'show_training_info'}
+    assert all(rate > 0 for rate in result.values())
@@ -0,0 +1,318 @@
+"""Дифференциальная проверка ускоренных путей расчёта.
+
+Случайные и граничные пакеты считаются эталоном — методами объектов
+`Training` — и каждым ускоренным путём. Расхождение сужается до
+минимального пакета. Долгий прогон под нагрузкой включается
+переменной окружения HOMEWORK_SOAK_SECONDS.
+"""
+import io
+import math
+import os
+import random
+import tempfile
+import time
+from contextlib import contextmanager
+from fractions import Fraction
+
+import pytest
+
+import homework
+
+SOAK_SECONDS = float(os.environ.get('HOMEWORK_SOAK_SECONDS', 0))
+METRICS = ('distance', 'speed', 'calories')
+# Допуск сравнения: ускоренные пути считают теми же формулами
+# в том же порядке, поэтому результаты должны совпадать побитно.
+REL_TOL = 0.0
+
+EDGE_VALUES = {
+    'action': [1, 2, 999, 1000, 10 ** 6, 2 ** 31 - 1, 0.5, 1e160],
+    'duration': [1e-6, 0.001, 1 / 60, 0.5, 1, 24, 1e4],
+    'weight': [1, 0.1, 75, 300],
+    'height': [1, 2, 180, 0.5, 1e-3, 3.5],
+    'length_pool': [1, 25, 50, 0.5],
+    'count_pool': [1, 40, 1000, 0.25],
+}
+
+
+def random_packet(rng, workout_type):
+    fields = homework.TRAINING_TYPES[workout_type].FIELDS
+    data = []
+    for name in fields:
+        roll = rng.random()
+        if roll < 0.3:
+            data.append(rng.choice(EDGE_VALUES[name]))
+        elif roll < 0.6:
+            data.append(rng.randint(1, 50000))
+        else:
+            data.append(rng.uniform(1e-3, 1e4))
+    return data
+
+
+@contextmanager
+def without_numpy():
+    saved = homework.np
+    homework.np = None
+    try:
+        yield
+    finally:
+        homework.np = saved
+
+
+def reference(workout_type, rows):
+    """Метрики объектов по пакетам; тип ошибки, если расчёт упал."""
+    results = []
+    for row in rows:
+        training = homework.read_package(workout_type, list(row))
+        try:
+            results.append((training.get_distance(),
+                            training.get_mean_speed(),
+                            training.get_spent_calories()))
+        except ArithmeticError as error:
+            results.append(type(error))
+    return results
+
+
+def overflowed(wanted):
+    """Объекты упали с ошибкой или молча переполнились до inf."""
+    return isinstance(wanted, type) or not all(map(math.isfinite, wanted))
+
+
+def finite_rows(workout_type, rows, limit=math.inf):
+    """Пакеты, которые объекты считают в числа меньше `limit` по модулю."""
+    return [row for row, wanted in zip(rows, reference(workout_type, rows))
+            if not overflowed(wanted)
+            and all(abs(value) < limit for value in wanted)]
+
+
+def outcome(calculate, workout_type, rows):
+    """Результаты пути или тип ошибки, с которой он упал."""
+    try:
+        return calculate(workout_type, rows)
+    except ArithmeticError as error:
+        return type(error)
+
+
+def batch_rows(batch):
+    return list(zip(batch.distance, batch.speed, batch.calories))
+
+
+def columns(workout_type, rows):
+    fields = homework.TRAINING_TYPES[workout_type].FIELDS
+    return {name: [row[index] for row in rows]
+            for index, name in enumerate(fields)}
+
+
+def compute_batch_numpy(workout_type, rows):
+    if homework._load_numpy() is None:
+        pytest.skip('NumPy не установлен')
+    return batch_rows(homework.compute_batch(workout_type,
+                                             columns(workout_type, rows)))
+
+
+def compute_batch_python(workout_type, rows):
+    with without_numpy():
+        return batch_rows(homework.compute_batch(
+            workout_type, columns(workout_type, rows)))
+
+
+def training_store(workout_type, rows):
+    store = homework.TrainingStore(workout_type)
+    store.extend(rows)
+    return batch_rows(store.compute())
+
+
+def binary_file(workout_type, rows):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'packets.hwpk')
+        with open(path, 'wb') as file:
+            homework.write_binary(((workout_type, row) for row in rows),
+                                  file, block_size=7)
+        return [row for batch in homework.read_binary(path)
+                for row in batch_rows(batch)]
+
+
+def result_cache(workout_type, rows):
+    cache = homework.ResultCache(maxsize=4)
+    return [(info.distance, info.speed, info.calories)
+            for info in (cache.training_info(workout_type, row)
+                         for row in rows + rows)][len(rows):]
+
+
+PATHS = {
+    'compute_batch_numpy': compute_batch_numpy,
+    'compute_batch_python': compute_batch_python,
+    'training_store': training_store,
+    'binary_file': binary_file,
+    'result_cache': result_cache,
+}
+
+
+def same(expected, actual):
+    if math.isnan(expected):
+        return math.isnan(actual)
+    return expected == actual or math.isclose(expected, actual,
+                                              rel_tol=REL_TOL, abs_tol=0)
+
+
+def overflow_mismatch(calculate, workout_type, row, wanted):
+    """Расхождение на пакете, где объекты упали или дали inf."""
+    got = outcome(calculate, workout_type, [row])
+    if got is wanted:
+        return None
+    if isinstance(wanted, type):
+        return row, 'error', wanted, got
+    if got is OverflowError:
+        return None
+    if isinstance(got, type):
+        return row, 'error', wanted, got
+    for metric, wanted_value, got_value in zip(METRICS, wanted, got[0]):
+        if not same(wanted_value, got_value):
+            return row, metric, wanted_value, got_value
+    return None
+
+
+def find_mismatch(path, workout_type, rows):
+    """Первое расхождение пути с эталоном: (пакет, метрика, ждали, есть).
+
+    Пакет, на котором падают объекты, путь должен отвергать той же
+    ошибкой; такие пакеты проверяются по одному. Умножение чисел
+    Python переполняется в inf молча, а NumPy поднимает OverflowError,
+    поэтому на пакете с inf в эталоне годится и то и другое.
+    """
+    expected = reference(workout_type, rows)
+    calculate = PATHS[path] if isinstance(path, str) else path
+    for row, wanted in zip(rows, expected):
+        if overflowed(wanted):
+            mismatch = overflow_mismatch(calculate, workout_type, row, wanted)
+            if mismatch:
+                return mismatch
+    good = [index for index, wanted in enumerate(expected)
+            if not overflowed(wanted)]
+    if not good:
+        return None
+    rows = [rows[index] for index in good]
+    expected = [expected[index] for index in good]
+    actual = calculate(workout_type, rows)
+    assert len(actual) == len(expected), (
+        '%s вернул %d результатов вместо %d'
+        % (path, len(actual), len(expected))
+    )
+    for row, wanted, got in zip(rows, expected, actual):
+        for metric, wanted_value, got_value in zip(METRICS, wanted, got):
+            if not same(wanted_value, got_value):
+                return row, metric, wanted_value, got_value
+    return None
+
+
+def simpler_values(value):
+    """Кандидаты проще `value`: меньшие круглые числа и округление."""
+    simpler = [candidate for candidate in (1, 2, 10, 100, 1000)
+               if candidate < value]
+    if value != round(value) and round(value) > 0:
+        simpler.append(round(value))
+    return simpler
+
+
+def shrink(path, workout_type, row):
+    """Упростить пакет, пока расхождение сохраняется."""
+    row = list(row)
+    changed = True
+    while changed:
+        changed = False
+        for index, value in enumerate(row):
+            for candidate in simpler_values(value):
+                trial = row[:index] + [candidate] + row[index + 1:]
+                if find_mismatch(path, workout_type, [trial]):
+                    row, changed = trial, True
+                    break
+    return row
+
+
+def check(path, workout_type, rows):
+    mismatch = find_mismatch(path, workout_type, rows)
+    if mismatch is None:
+        return
+    minimal = shrink(path, workout_type, mismatch[0])
+    _, metric, wanted, got = find_mismatch(path, workout_type, [minimal])
+    pytest.fail('%s расходится с эталоном на пакете (%r, %r): '
+                '%s = %r вместо %r'
+                % (path, workout_type, minimal, metric, got, wanted))
+
+
+@pytest.mark.parametrize('path', list(PATHS))
+@pytest.mark.parametrize('workout_type', ['SWM', 'RUN', 'WLK'])
+def test_random_packets(path, workout_type):
+    rng = random.Random('%s:%s' % (path, workout_type))
+    rows = [random_packet(rng, workout_type) for _ in range(300)]
+    check(path, workout_type, rows)
+
+
+@pytest.mark.parametrize('path', list(PATHS))
+@pytest.mark.parametrize('workout_type', ['SWM', 'RUN', 'WLK'])
+def test_edge_packets(path, workout_type):
+    fields = homework.TRAINING_TYPES[workout_type].FIELDS
+    rows = []
+    for index, name in enumerate(fields):
+        for value in EDGE_VALUES[name]:
+            row = [EDGE_VALUES[field][0] for field in fields]
+            row[index] = value
+            rows.append(row)
+    check(path, workout_type, rows)
+
+
+def test_rendering_matches_get_message():
+    rng = random.Random('render')
+    for workout_type in ('SWM', 'RUN', 'WLK'):
+        rows = finite_rows(workout_type, [random_packet(rng, workout_type)
+                                          for _ in range(200)])
+        output = io.StringIO()
+        homework.write_batch(homework.compute_batch(
+            workout_type, columns(workout_type, rows)), output)
+        assert output.getvalue().splitlines() == [
+            homework.read_package(workout_type, row).show_training_info()
+            .get_message() for row in rows
+        ]
+
+
+def test_shrink_reports_minimal_packet():
+    def broken(workout_type, rows):
+        result = reference(workout_type, rows)
+        return [(distance, speed, calories + (row[0] > 500))
+                for row, (distance, speed, calories) in zip(rows, result)]
+
+    rows = [[1234.5, 2.75, 81.3], [17, 1, 75]]
+    assert find_mismatch(broken, 'RUN', rows)[0] == rows[0]
+    assert shrink(broken, 'RUN', rows[0]) == [1000, 1, 1], (
+        'Сужение должно находить минимальный пакет с расхождением.'
+    )
+
+
+@pytest.mark.skipif(not SOAK_SECONDS,
+                    reason='задайте HOMEWORK_SOAK_SECONDS для долгого прогона')
+def test_soak():
+    deadline = time.monotonic() + SOAK_SECONDS
+    aggregator = homework.AthleteAggregator(windows={'all': (1e12, 1e12)})
+    # Точная сумма калорий: знаменатели дробей из float — степени двойки
+    # не больше 2**1074, так что память не растёт с числом пакетов.
+    exact = Fraction(0)
+    packets = 0
+    seed = 0
+    while time.monotonic() < deadline:
+        seed += 1
+        rng = random.Random(seed)
+        for workout_type in ('SWM', 'RUN', 'WLK'):
+            rows = [random_packet(rng, workout_type) for _ in range(1000)]
+            for path in PATHS:
+                check(path, workout_type, rows)
+            # Огромные калории переполнили бы сумму за прогон.
+            for row in finite_rows(workout_type, rows, limit=1e100):
+                info = homework.read_package(
+                    workout_type, row).show_training_info()
+                aggregator.add('athlete', seed, info)
+                exact += Fraction(info.calories)
+                packets += 1
+        totals = aggregator.totals('athlete', 'all')
+        assert math.isclose(totals.calories, float(exact), rel_tol=1e-9), (
+            'Накопленные суммы разошлись с точной суммой после '
+            '%d пакетов' % packets
+        )
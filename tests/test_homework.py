@@ -1,7 +1,13 @@
+import asyncio
+import io
+import json
+import operator
+import random
 import re
 import pytest
 import types
 import inspect
+import threading
 from conftest import Capturing
 
 try:
@@ -363,3 +369,1386 @@ def test_main_output(input_data, expected):
     assert get_message_output == expected, (
         'Метод `main` должен печатать результат в консоль.\n'
     )
+
+
+BATCH_PACKAGES = {
+    'SWM': [[720, 1, 80, 25, 40], [420, 4, 20, 42, 4], [1206, 12, 6, 12, 6]],
+    'RUN': [[15000, 1, 75], [420, 4, 20], [1206, 12, 6]],
+    'WLK': [[9000, 1, 75, 180], [420, 4, 20, 42], [1206, 12, 6, 12]],
+}
+
+
+def batch_columns(workout_type):
+    fields = homework.TRAINING_TYPES[workout_type].FIELDS
+    rows = BATCH_PACKAGES[workout_type]
+    return {name: [row[i] for row in rows] for i, name in enumerate(fields)}
+
+
+@pytest.mark.parametrize('workout_type', ['SWM', 'RUN', 'WLK'])
+def test_compute_batch(workout_type):
+    result = homework.compute_batch(workout_type, batch_columns(workout_type))
+    assert len(result) == len(BATCH_PACKAGES[workout_type])
+    for i, data in enumerate(BATCH_PACKAGES[workout_type]):
+        training = homework.read_package(workout_type, data)
+        assert result.training_type == type(training).__name__
+        assert result.distance[i] == training.get_distance(), (
+            '`compute_batch` должна считать дистанцию как `get_distance`.'
+        )
+        assert result.speed[i] == training.get_mean_speed(), (
+            '`compute_batch` должна считать скорость как `get_mean_speed`.'
+        )
+        assert result.calories[i] == training.get_spent_calories(), (
+            '`compute_batch` должна считать калории как '
+            '`get_spent_calories`.'
+        )
+
+
+@pytest.mark.parametrize('workout_type', ['SWM', 'RUN', 'WLK'])
+def test_compute_batch_without_numpy(monkeypatch, workout_type):
+    expected = homework.compute_batch(workout_type,
+                                      batch_columns(workout_type))
+    monkeypatch.setattr(homework, 'np', None)
+    result = homework.compute_batch(workout_type, batch_columns(workout_type))
+    assert list(result.distance) == list(expected.distance)
+    assert list(result.speed) == list(expected.speed)
+    assert list(result.calories) == list(expected.calories)
+
+
+@pytest.mark.parametrize('use_numpy', [True, False])
+def test_compute_batch_zero_divisor(monkeypatch, use_numpy):
+    if not use_numpy:
+        monkeypatch.setattr(homework, 'np', None)
+    elif homework._load_numpy() is None:
+        pytest.skip('NumPy не установлен')
+    columns = batch_columns('WLK')
+    with pytest.raises(ZeroDivisionError):
+        homework.compute_batch('WLK', dict(columns, duration=[1, 0, 2]))
+    with pytest.raises(ZeroDivisionError):
+        homework.compute_batch('WLK', dict(columns, height=[180, 0, 1]))
+    with pytest.raises(OverflowError):
+        homework.compute_batch('WLK', dict(columns, action=[1e160, 1, 1]))
+    reordered = dict(reversed(list(columns.items())))
+    assert list(homework.compute_batch('WLK', reordered).duration) == [
+        1, 4, 12
+    ], 'Длительность должна браться из колонки `duration`.'
+
+
+def test_compute_batch_unknown_type():
+    with pytest.raises(ValueError):
+        homework.compute_batch('SQT', {})
+
+
+@pytest.mark.parametrize('line, expected', [
+    ('["RUN", [15000, 1, 75]]\n', ('RUN', [15000, 1, 75])),
+    ('{"workout_type": "WLK", "data": [9000, 1, 75, 180]}',
+     ('WLK', [9000, 1, 75, 180])),
+    ('SWM,720,1,80,25,40\n', ('SWM', [720, 1, 80, 25, 40])),
+    ('RUN, 15000, 1.5, 75', ('RUN', [15000, 1.5, 75])),
+])
+def test_parse_packet(line, expected):
+    assert homework.parse_packet(line) == expected, (
+        '`parse_packet` должна разбирать пакеты в JSON и CSV.'
+    )
+
+
+def test_stream_training_info():
+    lines = iter([
+        '["SWM", [720, 1, 80, 25, 40]]\n',
+        '\n',
+        'RUN,1206,12,6\n',
+        '{"workout_type": "WLK", "data": [9000, 1, 75, 180]}\n',
+    ])
+    messages = homework.stream_training_info(lines)
+    assert isinstance(messages, types.GeneratorType), (
+        '`stream_training_info` должна отдавать сообщения лениво.'
+    )
+    first = next(messages)
+    assert next(lines) == '\n', (
+        '`stream_training_info` не должна читать вход наперёд.'
+    )
+    assert first.get_message() == (
+        homework.read_package('SWM', [720, 1, 80, 25, 40])
+        .show_training_info().get_message()
+    )
+    assert [info.training_type for info in messages] == [
+        'Running', 'SportsWalking'
+    ]
+
+
+def test_run_streams_files(tmp_path):
+    packets = tmp_path / 'packets.jsonl'
+    packets.write_text('["SWM", [720, 1, 80, 25, 40]]\nRUN,1206,12,6\n',
+                       encoding='utf-8')
+    with Capturing() as output:
+        homework.run([str(packets)])
+    with Capturing() as expected:
+        homework.main(homework.read_package('SWM', [720, 1, 80, 25, 40]))
+        homework.main(homework.read_package('RUN', [1206, 12, 6]))
+    assert output == expected
+
+
+PARALLEL_LINES = [
+    'SWM,720,1,80,25,40', 'RUN,15000,1,75', 'WLK,9000,1,75,180',
+    'RUN,1206,12,6', 'SWM,420,4,20,42,4', 'WLK,420,4,20,42',
+] * 5
+
+
+@pytest.mark.parametrize('ordered', [True, False])
+def test_parallel_training_info(ordered):
+    expected = [info.get_message()
+                for info in homework.stream_training_info(PARALLEL_LINES)]
+    result = [info.get_message()
+              for info in homework.parallel_training_info(
+                  PARALLEL_LINES, workers=2, chunk_size=4, ordered=ordered)]
+    if ordered:
+        assert result == expected, (
+            'Параллельный режим должен совпадать с последовательным.'
+        )
+    else:
+        assert sorted(result) == sorted(expected)
+
+
+def test_parallel_training_info_error():
+    with pytest.raises(ValueError):
+        list(homework.parallel_training_info(['SQT,9210,5,85,160'],
+                                             workers=1))
+
+
+def test_InfoMessage_slots():
+    info_message = homework.InfoMessage('Running', 1, 2, 3, 4)
+    assert not hasattr(info_message, '__dict__'), (
+        '`InfoMessage` должен хранить поля в `__slots__`.'
+    )
+
+
+@pytest.mark.parametrize('workout_type', ['SWM', 'RUN', 'WLK'])
+def test_TrainingStore(workout_type):
+    store = homework.TrainingStore(workout_type)
+    store.extend(BATCH_PACKAGES[workout_type])
+    assert len(store) == len(BATCH_PACKAGES[workout_type])
+    assert store.nbytes == 8 * len(store) * len(store.columns)
+    result = store.compute()
+    for i, data in enumerate(BATCH_PACKAGES[workout_type]):
+        training = homework.read_package(workout_type, data)
+        assert type(store[i]) is type(training)
+        assert (store[i].show_training_info().get_message()
+                == training.show_training_info().get_message())
+        assert result.calories[i] == training.get_spent_calories()
+    assert [type(training) for training in store] == [
+        homework.TRAINING_TYPES[workout_type]
+    ] * len(store)
+
+
+def test_TrainingStore_arity():
+    store = homework.TrainingStore('RUN')
+    with pytest.raises(TypeError):
+        store.append([15000, 1])
+    assert len(store) == 0
+
+
+def test_TrainingStore_bad_value():
+    store = homework.TrainingStore('RUN')
+    with pytest.raises(TypeError):
+        store.append([15000, 'x', 75])
+    assert {len(column) for column in store.columns.values()} == {0}, (
+        'Плохое значение не должно оставлять колонки разной длины.'
+    )
+    store.append([1, 1, 1])
+    assert [store[0].action, store[0].weight] == [1, 1]
+
+
+RENDER_MESSAGES = [
+    homework.InfoMessage('Swimming', 1, 75, 1, 80),
+    homework.InfoMessage('Running', 12, 0.7838999999999999,
+                         0.065325, -81.32032799999999),
+    homework.InfoMessage('SportsWalking', 0.0005, 2.0005, 1e12, -0.0),
+]
+
+
+def test_write_messages():
+    output = io.StringIO()
+    count = homework.write_messages(RENDER_MESSAGES, output, batch_size=2)
+    assert count == len(RENDER_MESSAGES)
+    assert output.getvalue() == ''.join(
+        info.get_message() + '\n' for info in RENDER_MESSAGES
+    ), '`write_messages` должна писать строки как `get_message`.'
+
+
+@pytest.mark.parametrize('workout_type', ['SWM', 'RUN', 'WLK'])
+def test_write_batch(workout_type):
+    batch = homework.compute_batch(workout_type, batch_columns(workout_type))
+    output = io.StringIO()
+    assert homework.write_batch(batch, output, batch_size=2) == len(batch)
+    assert output.getvalue() == ''.join(
+        homework.read_package(workout_type, data)
+        .show_training_info().get_message() + '\n'
+        for data in BATCH_PACKAGES[workout_type]
+    ), '`write_batch` должна писать строки как `get_message`.'
+
+
+@pytest.mark.parametrize('workout_type, data', [
+    ('RUN', [15000, 1, 75]),
+    ('WLK', [9000, 1, 75, 180]),
+    ('SWM', [720, 1, 80, 25, 40]),
+])
+def test_show_training_info_reuses_metrics(monkeypatch, workout_type, data):
+    calls = []
+    original = homework.Training.get_distance
+
+    def counting_get_distance(self):
+        calls.append(self)
+        return original(self)
+    monkeypatch.setattr(homework.Training, 'get_distance',
+                        counting_get_distance)
+    training = homework.read_package(workout_type, data)
+    info = training.show_training_info()
+    assert len(calls) == 1, (
+        'Дистанция должна считаться один раз на `show_training_info`.'
+    )
+    assert (info.distance, info.speed, info.calories) == (
+        training.get_distance(), training.get_mean_speed(),
+        training.get_spent_calories()
+    )
+
+
+def test_show_training_info_custom_getters(squats):
+    class FastRunning(homework.Running):
+        def get_mean_speed(self):
+            return 2 * super().get_mean_speed()
+
+    info = FastRunning(15000, 1, 75).show_training_info()
+    assert info.speed == 2 * homework.Running(15000, 1, 75).get_mean_speed()
+    assert info.calories == FastRunning(15000, 1, 75).get_spent_calories(), (
+        'Переопределённые get_*-методы должны использоваться '
+        'в `show_training_info`.'
+    )
+    training = homework.read_package('SQT', [9210, 5, 85, 160])
+    assert training.show_training_info().calories == (
+        training.get_spent_calories()
+    )
+
+
+@pytest.mark.parametrize('workout_type, data', [
+    ('RUN', [15000, 1, 75]),
+    ('WLK', [9000, 1, 75, 180]),
+    ('SWM', [720, 1, 80, 25, 40]),
+])
+@pytest.mark.parametrize('getter', ['get_distance', 'get_mean_speed',
+                                    'get_spent_calories'])
+def test_show_training_info_patched_instance(workout_type, data, getter):
+    training = homework.read_package(workout_type, data)
+    setattr(training, getter, lambda: 100)
+    info = training.show_training_info()
+    assert getattr(info, {'get_distance': 'distance',
+                          'get_mean_speed': 'speed',
+                          'get_spent_calories': 'calories'}[getter]) == 100, (
+        'Подменённый у объекта get_*-метод должен использоваться '
+        'в `show_training_info`.'
+    )
+
+
+@pytest.mark.parametrize('workout_type, data, field, value', [
+    ('RUN', [15000, 1, 75], 'action', 9000),
+    ('RUN', [15000, 1, 75], 'duration', 2),
+    ('RUN', [15000, 1, 75], 'weight', 80),
+    ('WLK', [9000, 1, 75, 180], 'height', 170),
+    ('SWM', [720, 1, 80, 25, 40], 'length_pool', 50),
+    ('SWM', [720, 1, 80, 25, 40], 'count_pool', 20),
+])
+def test_patched_fields(workout_type, data, field, value):
+    training = homework.read_package(workout_type, data)
+    training.show_training_info()
+    setattr(training, field, value)
+    data[homework.TRAINING_TYPES[workout_type].FIELDS.index(field)] = value
+    fresh = homework.read_package(workout_type, data)
+    assert training.show_training_info() == fresh.show_training_info(), (
+        'Изменённые поля тренировки должны учитываться в расчёте.'
+    )
+
+
+def test_ResultCache():
+    cache = homework.ResultCache(maxsize=2)
+    first = cache.training_info('RUN', [15000, 1, 75])
+    assert first == homework.read_package(
+        'RUN', [15000, 1, 75]).show_training_info()
+    assert cache.training_info('RUN', (15000, 1, 75)) is first
+    cache.training_info('WLK', [9000, 1, 75, 180])
+    cache.training_info('RUN', [15000, 1, 75])
+    cache.training_info('SWM', [720, 1, 80, 25, 40])
+    assert len(cache) == 2
+    assert cache.stats == homework.CacheStats(hits=2, misses=3, evictions=1), (
+        'Кеш должен вытеснять давно не использованные пакеты.'
+    )
+    cache.training_info('WLK', [9000, 1, 75, 180])
+    assert cache.stats.misses == 4
+
+
+def test_stream_training_info_cache():
+    lines = ['RUN,15000,1,75'] * 5 + ['SWM,720,1,80,25,40']
+    cache = homework.ResultCache()
+    result = list(homework.stream_training_info(lines, cache))
+    assert result == list(homework.stream_training_info(lines))
+    assert (cache.stats.hits, cache.stats.misses) == (4, 2)
+    assert result == list(homework.parallel_training_info(
+        lines, workers=2, chunk_size=2, cache_size=8))
+
+
+def test_ResultCache_message(monkeypatch):
+    rendered = []
+    get_message = homework.InfoMessage.get_message
+
+    def counted(self):
+        rendered.append(self)
+        return get_message(self)
+
+    monkeypatch.setattr(homework.InfoMessage, 'get_message', counted)
+    lines = ['RUN,15000,1,75'] * 5 + ['SWM,720,1,80,25,40']
+    cache = homework.ResultCache()
+    texts = list(homework.stream_training_text(lines, cache))
+    assert texts == [info.get_message()
+                     for info in homework.stream_training_info(lines)]
+    assert len(rendered) == 2 + len(lines), (
+        'Повторный пакет не должен форматироваться заново.'
+    )
+    rendered.clear()
+    assert homework.format_reply(b'RUN,15000,1,75', False, cache) == texts[0]
+    assert rendered == []
+
+
+def test_run_cache_text(tmp_path):
+    packets = tmp_path / 'packets.csv'
+    packets.write_text('RUN,15000,1,75\nRUN,15000,1,75\nWLK,9000,1,75,180\n',
+                       encoding='utf-8')
+    with Capturing() as expected:
+        homework.run([str(packets)])
+    with Capturing() as output:
+        homework.run([str(packets), '--cache-size', '4'])
+    assert output == expected
+
+
+async def exchange(server_kwargs, lines, connect):
+    server = await homework.start_server(**server_kwargs)
+    async with server:
+        reader, writer = await connect(server)
+        writer.write(''.join(line + '\n' for line in lines).encode())
+        await writer.drain()
+        replies = [(await reader.readline()).decode().rstrip('\n')
+                   for _ in lines]
+        writer.close()
+        await writer.wait_closed()
+    return replies
+
+
+def connect_tcp(server):
+    host, port = server.sockets[0].getsockname()[:2]
+    return asyncio.open_connection(host, port)
+
+
+def test_server_pipelining():
+    lines = ['RUN,15000,1,75', '["SWM", [720, 1, 80, 25, 40]]',
+             'SQT,9210,5,85,160', 'WLK,9000,1,75,180']
+    replies = asyncio.run(exchange({'host': '127.0.0.1', 'port': 0},
+                                   lines, connect_tcp))
+    assert replies[0] == homework.read_package(
+        'RUN', [15000, 1, 75]).show_training_info().get_message()
+    assert replies[1].startswith('Тип тренировки: Swimming;')
+    assert replies[2].startswith('Ошибка: ValueError'), (
+        'Сервер должен отвечать ошибкой на неизвестный пакет '
+        'и продолжать работу.'
+    )
+    assert replies[3].startswith('Тип тренировки: SportsWalking;')
+
+
+def test_server_unix_json(tmp_path):
+    path = str(tmp_path / 'tracker.sock')
+    replies = asyncio.run(exchange(
+        {'path': path, 'structured': True},
+        ['RUN,15000,1,75', 'RUN,15000,0,75'],
+        lambda server: asyncio.open_unix_connection(path)))
+    assert json.loads(replies[0]) == {
+        'training_type': 'Running', 'duration': 1, 'distance': 9.75,
+        'speed': 9.75, 'calories': 699.75,
+    }
+    assert 'ZeroDivisionError' in json.loads(replies[1])['error']
+
+
+@pytest.mark.parametrize('packet, error', [
+    (b'\xff\xfe', 'UnicodeDecodeError'),
+    (b'WLK,1e160,1,75,180', 'OverflowError'),
+])
+def test_server_bad_packet_keeps_connection(packet, error):
+    async def scenario():
+        server = await homework.start_server(host='127.0.0.1', port=0)
+        async with server:
+            reader, writer = await connect_tcp(server)
+            writer.write(packet + b'\nRUN,15000,1,75\n')
+            await writer.drain()
+            replies = [(await asyncio.wait_for(reader.readline(), 5))
+                       .decode().rstrip('\n') for _ in range(2)]
+            writer.close()
+            await writer.wait_closed()
+        return replies
+
+    replies = asyncio.run(scenario())
+    assert replies[0].startswith('Ошибка: ' + error), (
+        'Плохой пакет должен получать строку с ошибкой.'
+    )
+    assert replies[1].startswith('Тип тренировки: Running;'), (
+        'После ошибочного пакета соединение должно продолжать работать.'
+    )
+
+
+def test_server_max_connections():
+    async def scenario():
+        server = await homework.start_server(host='127.0.0.1', port=0,
+                                             max_connections=1)
+        async with server:
+            first = await connect_tcp(server)
+            second = await connect_tcp(server)
+            for _, writer in (first, second):
+                writer.write(b'RUN,15000,1,75\n')
+                await writer.drain()
+            assert await first[0].readline()
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(second[0].readline(), 0.2)
+            first[1].close()
+            assert await asyncio.wait_for(second[0].readline(), 5)
+            second[1].close()
+    asyncio.run(scenario())
+
+
+@pytest.fixture
+def instrumentation():
+    instrumentation = homework.Instrumentation()
+    yield instrumentation
+    instrumentation.disable()
+
+
+def test_instrumentation_disabled_is_free(instrumentation):
+    original = homework.read_package
+    assert not instrumentation.enabled
+    instrumentation.enable()
+    assert homework.read_package is not original
+    instrumentation.disable()
+    assert homework.read_package is original, (
+        'Выключенные замеры не должны оборачивать функции модуля.'
+    )
+    assert homework.Running.get_spent_calories.__name__ == (
+        'get_spent_calories'
+    )
+
+
+def test_instrumentation_snapshot(instrumentation):
+    instrumentation.enable()
+    with Capturing():
+        for input_data in (['SWM', [720, 1, 80, 25, 40]],
+                           ['RUN', [15000, 1, 75]],
+                           ['RUN', [1206, 12, 6]]):
+            homework.main(homework.read_package(*input_data))
+    instrumentation.disable()
+    homework.read_package('RUN', [15000, 1, 75])
+    snapshot = instrumentation.snapshot()
+    assert snapshot['read_package']['count'] == 3
+    assert snapshot['show_training_info']['count'] == 3
+    assert snapshot['get_message']['count'] == 3
+    assert snapshot['Running.get_spent_calories']['count'] == 2
+    assert snapshot['Swimming.get_spent_calories']['count'] == 1
+    assert snapshot['SportsWalking.get_spent_calories']['count'] == 0
+    assert sum(snapshot['read_package']['buckets']) == 3
+    text = instrumentation.prometheus()
+    assert ('homework_stage_seconds_count{stage="read_package"} 3'
+            in text.splitlines())
+    assert ('homework_stage_seconds_bucket{stage="read_package",le="+Inf"} 3'
+            in text.splitlines())
+    instrumentation.reset()
+    assert instrumentation.snapshot()['read_package']['count'] == 0
+
+
+def test_instrumentation_profile_batches(instrumentation, tmp_path):
+    instrumentation.profiler = homework.cprofile_batches(str(tmp_path))
+    for _ in range(2):
+        with instrumentation.batch('chunk'):
+            homework.read_package('RUN', [15000, 1, 75]).show_training_info()
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        'chunk-0.prof', 'chunk-1.prof'
+    ]
+    assert instrumentation.snapshot()['chunk']['count'] == 2
+
+
+def test_run_metrics(tmp_path):
+    packets = tmp_path / 'packets.csv'
+    packets.write_text('RUN,15000,1,75\nWLK,9000,1,75,180\n',
+                       encoding='utf-8')
+    metrics = tmp_path / 'metrics.prom'
+    with Capturing():
+        homework.run([str(packets), '--metrics', str(metrics)])
+    assert not homework.instrumentation.enabled
+    text = metrics.read_text(encoding='utf-8')
+    assert 'homework_stage_seconds_count{stage="read_package"} 2' in text
+    assert 'homework_stage_seconds_count{stage="run"} 1' in text
+    assert 'homework_stage_seconds_count{stage="format_messages"} 1' in text, (
+        'Замеры должны видеть сборку текста, которой пишет командная строка.'
+    )
+
+
+def test_run_metrics_batch(tmp_path):
+    packets = tmp_path / 'packets.hwpk'
+    with open(packets, 'wb') as file:
+        homework.write_binary([('RUN', [15000, 1, 75])], file)
+    metrics = tmp_path / 'metrics.prom'
+    with Capturing():
+        homework.run([str(packets), '--binary', '--metrics', str(metrics)])
+    text = metrics.read_text(encoding='utf-8')
+    assert 'homework_stage_seconds_count{stage="format_results"} 1' in text
+
+
+@pytest.mark.parametrize('option', [['--workers', '2'], ['--shards', '2']])
+def test_run_metrics_other_processes(tmp_path, capsys, option):
+    with pytest.raises(SystemExit):
+        homework.run([str(tmp_path / 'packets.csv'), '--metrics',
+                      str(tmp_path / 'metrics.prom'), *option])
+    assert '--metrics' in capsys.readouterr().err
+
+
+BINARY_PACKETS = [
+    ('SWM', [720, 1, 80, 25, 40]),
+    ('RUN', [15000, 1, 75]),
+    ('WLK', [9000, 1, 75, 180]),
+    ('RUN', [1206, 12, 6]),
+    ('RUN', [420, 4.5, 20]),
+]
+
+
+@pytest.mark.parametrize('use_numpy', [True, False])
+def test_binary_roundtrip(monkeypatch, tmp_path, use_numpy):
+    if not use_numpy:
+        monkeypatch.setattr(homework, 'np', None)
+    path = tmp_path / 'packets.hwpk'
+    with open(path, 'wb') as file:
+        assert homework.write_binary(BINARY_PACKETS, file, block_size=2) == 5
+    blocks = list(homework.iter_binary_blocks(str(path)))
+    assert [workout_type for workout_type, _ in blocks] == [
+        'RUN', 'SWM', 'RUN', 'WLK'
+    ], 'Пакеты должны писаться блоками по видам тренировок.'
+    output = io.StringIO()
+    for batch in homework.read_binary(str(path)):
+        homework.write_batch(batch, output)
+    expected = [homework.read_package(*packet).show_training_info()
+                .get_message() for packet in BINARY_PACKETS]
+    assert sorted(output.getvalue().splitlines()) == sorted(expected)
+
+
+def test_binary_errors(tmp_path):
+    empty = tmp_path / 'empty.hwpk'
+    empty.write_bytes(b'')
+    assert list(homework.read_binary(str(empty))) == []
+    path = tmp_path / 'packets.hwpk'
+    with open(path, 'wb') as file:
+        homework.write_binary(BINARY_PACKETS, file)
+    data = path.read_bytes()
+    path.write_bytes(data[:-8])
+    with pytest.raises(ValueError):
+        list(homework.read_binary(str(path)))
+    path.write_bytes(b'JUNK' + data[4:])
+    with pytest.raises(ValueError):
+        list(homework.read_binary(str(path)))
+
+
+def test_run_binary(tmp_path):
+    packets = tmp_path / 'packets.csv'
+    packets.write_text('RUN,15000,1,75\nRUN,1206,12,6\n', encoding='utf-8')
+    binary = tmp_path / 'packets.hwpk'
+    homework.run([str(packets), '--to-binary', str(binary)])
+    with Capturing() as output:
+        homework.run([str(binary), '--binary'])
+    with Capturing() as expected:
+        homework.run([str(packets)])
+    assert output == expected
+
+
+@pytest.fixture
+def squats():
+    @homework.register_training('SQT')
+    class Squats(homework.Training):
+        """Тренировка: приседания."""
+        LEN_STEP = 0.0
+        FIELDS = homework.Training.FIELDS + ('depth',)
+
+        def __init__(self, action, duration, weight, depth):
+            super().__init__(action, duration, weight)
+            self.depth = depth
+
+        def get_spent_calories(self):
+            return self.action * self.depth * self.weight / 1000
+    yield Squats
+    homework.unregister_training('SQT')
+
+
+def test_register_training(squats):
+    training = homework.read_package('SQT', [9210, 5, 85, 160])
+    assert isinstance(training, squats), (
+        'Зарегистрированный вид должен читаться `read_package`.'
+    )
+    assert training.show_training_info().calories == 9210 * 160 * 85 / 1000
+
+
+def test_unregister_training(squats):
+    homework.unregister_training('SQT')
+    with pytest.raises(ValueError):
+        homework.read_package('SQT', [9210, 5, 85, 160])
+    homework.register_training('SQT', squats)
+
+
+@pytest.mark.parametrize('workout_type, training_class, error', [
+    ('SQUAT', homework.Running, ValueError),
+    ('SQT', dict, TypeError),
+    ('SQT', type('Squats', (homework.Training,), {'FIELDS': ('action',)}),
+     TypeError),
+])
+def test_register_training_errors(workout_type, training_class, error):
+    with pytest.raises(error):
+        homework.register_training(workout_type, training_class)
+    assert 'SQT' not in homework.TRAINING_TYPES
+
+
+@pytest.mark.parametrize('workout_type, data', [
+    ('RUN', [15000, 1]),
+    ('WLK', [9000, 1, 75]),
+    ('SWM', [720, 1, 80, 25, 40, 1]),
+])
+def test_read_package_arity(workout_type, data):
+    with pytest.raises(TypeError):
+        homework.read_package(workout_type, data)
+
+
+def test_read_packages():
+    stores = homework.read_packages(BINARY_PACKETS)
+    assert {workout_type: len(store)
+            for workout_type, store in stores.items()} == {
+        'SWM': 1, 'RUN': 3, 'WLK': 1,
+    }
+    assert [training.show_training_info() for training in stores['RUN']] == [
+        homework.read_package(*packet).show_training_info()
+        for packet in BINARY_PACKETS if packet[0] == 'RUN'
+    ]
+
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+
+def test_AthleteAggregator():
+    aggregator = homework.AthleteAggregator()
+    run = homework.read_package('RUN', [15000, 1, 75])
+    swim = homework.read_package('SWM', [720, 2, 80, 25, 40])
+    aggregator.add('alice', 0, run)
+    aggregator.add('alice', 10 * HOUR, swim.show_training_info())
+    aggregator.add('bob', HOUR, run)
+    day = aggregator.totals('alice', 'day')
+    assert day.workouts == 2
+    assert day.distance == run.get_distance() + swim.get_distance()
+    assert day.calories == (run.get_spent_calories()
+                            + swim.get_spent_calories())
+    assert day.mean_speed == pytest.approx(
+        (run.get_mean_speed() * 1 + swim.get_mean_speed() * 2) / 3
+    ), 'Средняя скорость должна взвешиваться длительностью.'
+    later = aggregator.totals('alice', 'day', now=DAY + 5 * HOUR)
+    assert later.workouts == 1, (
+        'Тренировки старше окна должны уходить из итогов.'
+    )
+    assert aggregator.totals('alice', 'week', now=DAY + 5 * HOUR).workouts == 2
+    assert aggregator.totals('carol', 'day').workouts == 0
+
+
+def test_AthleteAggregator_late_events():
+    aggregator = homework.AthleteAggregator()
+    info = homework.read_package('RUN', [15000, 1, 75]).show_training_info()
+    for timestamp in (5 * HOUR, 2 * HOUR, 5 * HOUR + 1, 3 * HOUR):
+        aggregator.add('alice', timestamp, info)
+    aggregator.add('alice', 25 * HOUR, info)
+    aggregator.add('alice', 0, info)
+    assert aggregator.totals('alice', 'day').workouts == 5
+    assert aggregator.totals('alice', 'day', now=27 * HOUR).workouts == 3
+    assert aggregator.totals('alice', 'day', now=60 * HOUR).workouts == 0
+
+
+def test_AthleteAggregator_memory_bound():
+    aggregator = homework.AthleteAggregator(max_athletes=2)
+    info = homework.read_package('RUN', [15000, 1, 75]).show_training_info()
+    for athlete in ('alice', 'bob', 'alice', 'carol'):
+        aggregator.add(athlete, 0, info)
+    assert len(aggregator) == 2
+    assert aggregator.totals('bob', 'day').workouts == 0
+    assert aggregator.totals('alice', 'day').workouts == 2
+    aggregator.add('alice', 8 * DAY, info)
+    assert aggregator.expire(8 * DAY) == 1
+    assert len(aggregator) == 1
+
+
+class CountingStream(io.StringIO):
+    def __init__(self):
+        super().__init__()
+        self.writes = 0
+
+    def write(self, text):
+        self.writes += 1
+        return super().write(text)
+
+
+@pytest.mark.parametrize('sink_class', [homework.OutputSink,
+                                        homework.ThreadedSink])
+def test_OutputSink_flush_policy(sink_class):
+    stream = CountingStream()
+    sink = sink_class(stream, flush_lines=3, close_stream=False)
+    for _ in range(6):
+        homework.main(homework.read_package('RUN', [15000, 1, 75]), sink)
+    sink.write_messages(RENDER_MESSAGES)
+    sink.close()
+    expected = [homework.read_package('RUN', [15000, 1, 75])
+                .show_training_info().get_message()] * 6 + [
+        info.get_message() for info in RENDER_MESSAGES
+    ]
+    assert stream.getvalue().splitlines() == expected
+    assert stream.writes == 3, (
+        'Вывод должен писаться пачками по политике сброса.'
+    )
+
+
+def test_OutputSink_buffer_size():
+    stream = CountingStream()
+    with homework.OutputSink(stream, buffer_size=10,
+                             close_stream=False) as sink:
+        sink.write('12345')
+        assert stream.writes == 0
+        sink.write('67890')
+        assert stream.writes == 1
+        sink.write('x')
+    assert stream.getvalue() == '1234567890x'
+
+
+def test_ThreadedSink_error():
+    class BrokenStream(io.StringIO):
+        def write(self, text):
+            raise OSError('диск переполнен')
+
+    sink = homework.ThreadedSink(BrokenStream(), flush_lines=1)
+    sink.write('строка\n')
+    with pytest.raises(OSError):
+        sink.close()
+
+
+@pytest.mark.parametrize('name, compression, threaded', [
+    ('out.txt', None, False),
+    ('out.txt.gz', None, True),
+    ('out.bin', 'gzip', False),
+])
+def test_open_sink(tmp_path, name, compression, threaded):
+    import gzip
+
+    path = tmp_path / name
+    with homework.open_sink(str(path), compression, threaded) as sink:
+        sink.write_messages(RENDER_MESSAGES)
+    opener = gzip.open if compression or name.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as file:
+        assert file.read().splitlines() == [
+            info.get_message() for info in RENDER_MESSAGES
+        ]
+
+
+def test_open_sink_unknown_compression(tmp_path):
+    with pytest.raises(ValueError):
+        homework.open_sink(str(tmp_path / 'out'), 'lzma')
+
+
+def test_run_output(tmp_path):
+    packets = tmp_path / 'packets.csv'
+    packets.write_text('RUN,15000,1,75\nRUN,1206,12,6\n', encoding='utf-8')
+    output = tmp_path / 'out.txt'
+    homework.run([str(packets), '--output', str(output),
+                  '--threaded-output', '--flush-lines', '1'])
+    with Capturing() as expected:
+        homework.run([str(packets)])
+    assert output.read_text(encoding='utf-8').splitlines() == expected
+
+
+def read_export(path, export_format):
+    if export_format == 'csv':
+        import csv
+
+        with open(path, encoding='utf-8', newline='') as file:
+            return [(row['training_type'],
+                     *(float(row[name])
+                       for name in homework.RESULT_FIELDS[1:]))
+                    for row in csv.DictReader(file)]
+    if export_format == 'jsonl':
+        with open(path, encoding='utf-8') as file:
+            return [tuple(json.loads(line)[name]
+                          for name in homework.RESULT_FIELDS)
+                    for line in file]
+    if export_format == 'columnar':
+        return [row
+                for block in homework.read_results(path)
+                for row in zip(*(block[name]
+                                 for name in homework.RESULT_FIELDS))]
+    import pyarrow.parquet
+
+    table = pyarrow.parquet.read_table(path)
+    return list(zip(*(table.column(name).to_pylist()
+                      for name in homework.RESULT_FIELDS)))
+
+
+@pytest.mark.parametrize('export_format, suffix', [
+    ('csv', '.csv'), ('jsonl', '.jsonl'), ('columnar', '.hwr'),
+    ('parquet', '.parquet'),
+])
+def test_export_results(tmp_path, export_format, suffix):
+    if export_format == 'parquet':
+        pytest.importorskip('pyarrow')
+    path = str(tmp_path / ('results' + suffix))
+    batch = homework.compute_batch('WLK', batch_columns('WLK'))
+    with homework.open_result_writer(path, chunk_size=2) as writer:
+        assert writer.write_messages(RENDER_MESSAGES) == 3
+        assert writer.write_batch(batch) == 3
+    expected = [(info.training_type, info.duration, info.distance,
+                 info.speed, info.calories) for info in RENDER_MESSAGES]
+    expected += [('SportsWalking', *row) for row in zip(
+        batch.duration, batch.distance, batch.speed, batch.calories)]
+    assert read_export(path, export_format) == expected, (
+        'Выгрузка должна сохранять поля результатов без потерь.'
+    )
+
+
+def test_open_result_writer_unknown(tmp_path):
+    with pytest.raises(ValueError):
+        homework.open_result_writer(str(tmp_path / 'results.txt'))
+
+
+def test_run_export(tmp_path):
+    packets = tmp_path / 'packets.csv'
+    packets.write_text('RUN,15000,1,75\nSWM,720,1,80,25,40\n',
+                       encoding='utf-8')
+    export = tmp_path / 'results.jsonl'
+    homework.run([str(packets), '--export', str(export)])
+    assert [row[0] for row in read_export(export, 'jsonl')] == [
+        'Running', 'Swimming'
+    ]
+
+
+VALIDATION_PACKETS = [
+    ('RUN', [15000, 1, 75]),
+    ('RUN', [15000, 0, 75]),
+    ('WLK', [9000, 1, 75, 0]),
+    ('WLK', [9000, 1, 75]),
+    ('SQT', [9210, 5, 85, 160]),
+    ('SWM', [720, 1, 80, 25, 40]),
+    ('SWM', [720, 1, -80, 25, float('nan')]),
+    ('RUN', [15000, float('inf'), 75]),
+    ('RUN', ['15000', 1, 75]),
+    ('RUN',),
+    ('WLK', [9000, 1, 75, 180]),
+    ('WLK', [1e160, 1, 75, 180]),
+    ('RUN', [10 ** 400, 1, 75]),
+    ('RUN', [1e308, 1e-300, 75]),
+]
+
+
+@pytest.mark.parametrize('use_numpy', [True, False])
+def test_validate_packets(monkeypatch, use_numpy):
+    if not use_numpy:
+        monkeypatch.setattr(homework, 'np', None)
+    good, rejected = homework.validate_packets(VALIDATION_PACKETS)
+    assert good == [VALIDATION_PACKETS[index] for index in (0, 5, 10)], (
+        'Годные пакеты должны проходить проверку в исходном порядке.'
+    )
+    assert [packet.packet for packet in rejected] == [
+        VALIDATION_PACKETS[index]
+        for index in (1, 2, 3, 4, 6, 7, 8, 9, 11, 12, 13)
+    ]
+    reasons = [packet.reason for packet in rejected]
+    assert 'duration' in reasons[0]
+    assert 'height' in reasons[1]
+    assert 'ожидает 4' in reasons[2]
+    assert 'SQT' in reasons[3]
+    assert 'weight' in reasons[4]
+    assert 'float' in reasons[8]
+    assert 'action' in reasons[9]
+    assert 'float' in reasons[10], (
+        'Пакеты, на которых переполняется расчёт, должны отклоняться.'
+    )
+    for packet in good:
+        homework.read_package(*packet).show_training_info()
+
+
+@pytest.mark.parametrize('use_numpy', [True, False])
+def test_validated_training_info(monkeypatch, use_numpy):
+    if not use_numpy:
+        monkeypatch.setattr(homework, 'np', None)
+    lines = ['RUN,15000,1,75', 'RUN,15000,0,75', 'not a packet',
+             '{"workout_type": "WLK"}', 'WLK,9000,1,75,180', '',
+             'RUN,%s,1,75' % ('9' * 400), 'WLK,1e160,1,75,180']
+    dead_letter = io.StringIO()
+    messages = list(homework.validated_training_info(lines, dead_letter,
+                                                     chunk_size=2))
+    assert messages == list(homework.stream_training_info(
+        ['RUN,15000,1,75', 'WLK,9000,1,75,180']
+    )), 'Плохие пакеты не должны останавливать обработку.'
+    rejected = [json.loads(line) for line in dead_letter.getvalue()
+                .splitlines()]
+    assert [record['packet'] for record in rejected] == [
+        ['RUN', [15000, 0, 75]], '{"workout_type": "WLK"}',
+        ['not a packet', []], ['RUN', [int('9' * 400), 1, 75]],
+        ['WLK', [1e160, 1, 75, 180]],
+    ]
+    assert all(record['reason'] for record in rejected)
+
+
+def test_validated_training_info_computes_once(monkeypatch):
+    monkeypatch.setattr(homework, 'np', None)
+    calls = []
+    original = homework.Training.show_training_info
+
+    def counted(self):
+        calls.append(self)
+        return original(self)
+
+    monkeypatch.setattr(homework.Training, 'show_training_info', counted)
+    lines = ['RUN,15000,1,75', 'WLK,9000,1,75,180', 'RUN,15000,1,75']
+    messages = list(homework.validated_training_info(lines, io.StringIO()))
+    assert len(messages) == 3
+    assert len(calls) == 3, (
+        'Годный пакет должен считаться один раз, при проверке.'
+    )
+    cache = homework.ResultCache()
+    calls.clear()
+    assert list(homework.validated_training_info(
+        lines, io.StringIO(), chunk_size=1, cache=cache)) == messages
+    assert len(calls) == 2
+    assert (cache.stats.hits, cache.stats.misses) == (1, 2)
+
+
+def test_run_dead_letter(tmp_path):
+    packets = tmp_path / 'packets.csv'
+    packets.write_text('RUN,15000,1,75\nSQT,9210,5,85,160\nRUN,1206,12,6\n',
+                       encoding='utf-8')
+    dead_letter = tmp_path / 'rejected.jsonl'
+    with Capturing() as output:
+        homework.run([str(packets), '--dead-letter', str(dead_letter)])
+    assert len(output) == 2
+    assert 'SQT' in dead_letter.read_text(encoding='utf-8')
+
+
+@pytest.mark.parametrize('use_numpy', [True, False])
+def test_run_binary_dead_letter(monkeypatch, tmp_path, use_numpy):
+    if not use_numpy:
+        monkeypatch.setattr(homework, 'np', None)
+    packets = tmp_path / 'packets.hwpk'
+    with open(packets, 'wb') as file:
+        homework.write_binary([('RUN', [15000, 1, 75]), ('RUN', [1, 0, 1]),
+                               ('WLK', [1e160, 1, 75, 180]),
+                               ('WLK', [9000, 1, 75, 180])], file)
+    dead_letter = tmp_path / 'rejected.jsonl'
+    with Capturing() as output:
+        homework.run([str(packets), '--binary',
+                      '--dead-letter', str(dead_letter)])
+    assert output == [
+        homework.read_package(*packet).show_training_info().get_message()
+        for packet in (('RUN', [15000, 1, 75]), ('WLK', [9000, 1, 75, 180]))
+    ], 'Плохие записи двоичного файла не должны останавливать обработку.'
+    rejected = [json.loads(line) for line in
+                dead_letter.read_text(encoding='utf-8').splitlines()]
+    assert [record['packet'] for record in rejected] == [
+        ['RUN', [1, 0, 1]], ['WLK', [1e160, 1, 75, 180]]
+    ]
+
+
+def test_run_binary_sort(tmp_path):
+    packets = tmp_path / 'packets.hwpk'
+    with open(packets, 'wb') as file:
+        homework.write_binary(BINARY_PACKETS, file, block_size=2)
+    with Capturing() as output:
+        homework.run([str(packets), '--binary', '--sort'])
+    messages = [homework.read_package(*packet).show_training_info()
+                for packet in BINARY_PACKETS]
+    messages.sort(key=lambda info: (info.training_type, info.calories))
+    assert output == [info.get_message() for info in messages], (
+        '--sort должен сортировать и результаты двоичных файлов.'
+    )
+
+
+SHARD_LINES = [
+    'RUN,15000,1,75', '{"workout_type": "SWM", "data": [720, 1, 80, 25, 40],'
+    ' "athlete": "anna"}', 'WLK,9000,1,75,180',
+    '{"workout_type": "RUN", "data": [12000, 1.5, 70], "athlete": "anna"}',
+    '', 'RUN,1206,12,6', '["SWM", [1000, 0.5, 60, 50, 20]]',
+] * 7
+
+
+async def shard_workers(tmp_path, count, flaky=False):
+    """Исполнители шардов в том же цикле событий вместо отдельных узлов."""
+    failed = []
+
+    async def flaky_handler(reader, writer):
+        if not failed:
+            failed.append(True)
+            writer.close()
+            return
+        await homework.handle_shard_requests(reader, writer)
+
+    servers, paths = [], []
+    for index in range(count):
+        path = str(tmp_path / ('w%d.sock' % index))
+        if flaky and index == 0:
+            servers.append(await asyncio.start_unix_server(flaky_handler,
+                                                           path))
+        else:
+            servers.append(await homework.start_shard_worker(path))
+        paths.append(path)
+    return servers, paths
+
+
+@pytest.mark.parametrize('shards', [1, 3, 7, 50])
+def test_shard_by_range(tmp_path, shards):
+    packets = tmp_path / 'packets.txt'
+    packets.write_text('\n'.join(SHARD_LINES) + '\n', encoding='utf-8')
+
+    async def scenario():
+        servers, paths = await shard_workers(tmp_path, 2)
+        coordinator = homework.ShardCoordinator(paths)
+        result = await coordinator.run(
+            homework.shard_by_range([str(packets)] * 2, shards))
+        for server in servers:
+            server.close()
+        return result
+
+    result = [info for messages in asyncio.run(scenario())
+              for info in messages]
+    assert result == list(homework.stream_training_info(SHARD_LINES * 2)), (
+        'Шарды по байтам, склеенные по порядку, должны давать те же '
+        'сообщения в порядке входа.'
+    )
+
+
+def shard_lines(shards):
+    return [list(homework._shard_lines(shard)) for shard in shards]
+
+
+def test_shard_by_athlete(tmp_path):
+    shards = homework.shard_by_athlete(iter(SHARD_LINES), 4, str(tmp_path))
+    assert [shard.index for shard in shards] == [0, 1, 2, 3]
+    lines = shard_lines(shards)
+    assert sum(map(len, lines)) == 42
+    anna = [index for index, shard in enumerate(lines)
+            for line in shard if '"anna"' in line]
+    assert len(set(anna)) == 1, (
+        'Пакеты одного спортсмена должны попадать в один шард.'
+    )
+    again = tmp_path / 'again'
+    again.mkdir()
+    assert lines == shard_lines(
+        homework.shard_by_athlete(SHARD_LINES, 4, str(again)))
+
+
+def test_ShardCoordinator_retries(tmp_path):
+    shards = homework.shard_by_athlete(SHARD_LINES, 5, str(tmp_path))
+
+    async def scenario():
+        servers, paths = await shard_workers(tmp_path, 2, flaky=True)
+        coordinator = homework.ShardCoordinator(
+            [str(tmp_path / 'missing.sock')] + paths)
+        result = await coordinator.run(shards)
+        for server in servers:
+            server.close()
+        return coordinator, result
+
+    coordinator, result = asyncio.run(scenario())
+    assert [[info for info in messages] for messages in result] == [
+        list(homework.stream_training_info(lines))
+        for lines in shard_lines(shards)
+    ], 'Результат не должен зависеть от сбоев исполнителей.'
+    failed_workers = {path for _, path, _ in coordinator.failures}
+    assert len(coordinator.failures) == 2
+    assert str(tmp_path / 'missing.sock') in failed_workers
+
+
+def test_ShardCoordinator_dead_workers(tmp_path):
+    shards = homework.shard_by_athlete(SHARD_LINES, 1, str(tmp_path))
+    dead = [str(tmp_path / ('dead%d.sock' % index)) for index in range(3)]
+
+    async def scenario():
+        servers, paths = await shard_workers(tmp_path, 1)
+        coordinator = homework.ShardCoordinator(dead + paths, retries=2)
+        result = await coordinator.run(shards)
+        for server in servers:
+            server.close()
+        return coordinator, result
+
+    coordinator, result = asyncio.run(scenario())
+    assert result == [list(homework.stream_training_info(lines))
+                      for lines in shard_lines(shards)], (
+        'Недоступные исполнители не должны тратить попытки шарда.'
+    )
+    assert {path for _, path, _ in coordinator.failures} == set(dead)
+
+
+def test_ShardCoordinator_stream(tmp_path):
+    taken = []
+
+    def shards():
+        for shard in homework.shard_by_range([str(packets)], 20):
+            taken.append(shard.index)
+            yield shard
+
+    packets = tmp_path / 'packets.txt'
+    packets.write_text('\n'.join(SHARD_LINES) + '\n', encoding='utf-8')
+
+    async def scenario():
+        servers, paths = await shard_workers(tmp_path, 2)
+        stream = homework.ShardCoordinator(paths).stream(shards(), window=3)
+        first = await stream.__anext__()
+        seen = len(taken)
+        rest = [messages async for messages in stream]
+        for server in servers:
+            server.close()
+        return seen, [info for messages in [first] + rest
+                      for info in messages]
+
+    seen, result = asyncio.run(scenario())
+    assert seen <= 4, 'Координатор не должен забегать дальше окна.'
+    assert result == list(homework.stream_training_info(SHARD_LINES))
+
+
+@pytest.mark.parametrize('line, error', [
+    ('SQT,9210,5,85,160', 'Доступные типы'),
+    ('WLK,1e160,1,75,180', 'OverflowError'),
+])
+def test_ShardCoordinator_errors(tmp_path, line, error):
+    coordinator = None
+
+    async def scenario(shards, workers):
+        nonlocal coordinator
+        servers, paths = await shard_workers(tmp_path, workers)
+        coordinator = homework.ShardCoordinator(paths, retries=1)
+        try:
+            await coordinator.run(shards)
+        finally:
+            for server in servers:
+                server.close()
+
+    bad = homework.shard_by_athlete(['RUN,15000,1,75', line],
+                                    1, str(tmp_path))
+    with pytest.raises(RuntimeError, match=error):
+        asyncio.run(scenario(bad, 2))
+    assert coordinator.failures == [], (
+        'Ошибку в пакетах не нужно повторять на других исполнителях.'
+    )
+    with pytest.raises(RuntimeError, match='исполнителей'):
+        asyncio.run(scenario(bad, 0))
+
+
+def test_ShardCoordinator_timeout(tmp_path):
+    shards = homework.shard_by_athlete(SHARD_LINES, 1, str(tmp_path))
+
+    async def hang(reader, writer):
+        await reader.read()
+        writer.close()
+
+    async def scenario():
+        servers, paths = await shard_workers(tmp_path, 1)
+        slow = str(tmp_path / 'slow.sock')
+        servers.append(await asyncio.start_unix_server(hang, slow))
+        coordinator = homework.ShardCoordinator([slow] + paths,
+                                                timeout=0.2)
+        result = await coordinator.run(shards)
+        for server in servers:
+            server.close()
+        return coordinator, result
+
+    coordinator, result = asyncio.run(scenario())
+    assert result == [list(homework.stream_training_info(SHARD_LINES))]
+    assert [path for _, path, _ in coordinator.failures] == [
+        str(tmp_path / 'slow.sock')
+    ], 'Шард, не уложившийся в timeout, должен уйти другому исполнителю.'
+
+
+def test_sharded_training_info(tmp_path):
+    packets = tmp_path / 'packets.txt'
+    packets.write_text('\n'.join(SHARD_LINES) + '\n', encoding='utf-8')
+    shards = homework.shard_by_range([str(packets)], 6)
+    with homework.spawn_shard_workers(2) as paths:
+        assert list(homework.sharded_training_info(shards, paths)) == list(
+            homework.stream_training_info(SHARD_LINES))
+        messages = homework.sharded_training_info(shards, paths, window=1)
+        assert next(messages).training_type == 'Running'
+        messages.close()
+
+
+def test_run_shards(tmp_path):
+    packets = tmp_path / 'packets.txt'
+    packets.write_text('\n'.join(SHARD_LINES) + '\n', encoding='utf-8')
+    with Capturing() as expected:
+        homework.run([str(packets)])
+    with Capturing() as output:
+        homework.run([str(packets), '--shards', '4', '--workers', '2'])
+    assert output == expected, (
+        'Шардированный прогон по байтам должен сохранять порядок входа.'
+    )
+    with Capturing() as output:
+        homework.run([str(packets), '--shards', '3', '--shard-by',
+                      'athlete', '--workers', '2'])
+    assert sorted(output) == sorted(expected)
+
+
+def test_SampleWindow():
+    window = homework.SampleWindow(10, capacity=4)
+    for timestamp, actions in [(0, 1), (3, 2), (6, 3), (9, 4)]:
+        window.add(timestamp, actions)
+    assert (len(window), window.actions) == (4, 10)
+    assert window.span() == (9, 9)
+    window.add(14, 5)
+    assert (len(window), window.actions) == (3, 12), (
+        'Окно должно вытеснять отсчёты старше своей длины.'
+    )
+    window.add(15, 1)
+    window.add(16, 1)
+    assert (len(window), window.span()) == (4, (7, 7)), (
+        'Переполненный буфер должен вытеснять самые старые отсчёты.'
+    )
+    with pytest.raises(ValueError):
+        homework.SampleWindow(0)
+
+
+def test_SensorStream_laps_and_segments():
+    stream = homework.SensorStream('RUN', {'weight': 75}, pause=30, lap=1)
+    samples = [(index * 0.5, 1) for index in range(3500)]
+    samples += [(2000 + index * 0.5, 1) for index in range(500)]
+    segments = []
+    for timestamp, actions in samples:
+        segments += stream.add(timestamp, actions)
+    segments += stream.close()
+    assert [(item.segment, item.lap) for item in segments] == [
+        (0, 0), (0, 1), (0, 2), (1, 0)
+    ], 'Пауза должна начинать отрезок, дистанция — закрывать круг.'
+    first = segments[0]
+    actions = round(1 / 0.65 * 1000 + 0.5)
+    assert (first.start, first.end) == (0, actions * 0.5)
+    assert first.info == homework.read_package(
+        'RUN', [actions, actions * 0.5 / 3600, 75]).show_training_info()
+    assert sum(item.info.distance for item in segments) == pytest.approx(
+        (3499 + 499) * 0.65 / 1000)
+    assert stream.current().speed == pytest.approx(0.65 * 2 * 3.6)
+    with pytest.raises(ValueError):
+        stream.add(100, 1)
+
+
+def test_split_samples_swimming():
+    samples = [(index * 2.0, 1) for index in range(200)]
+    segments = list(homework.split_samples(
+        samples, 'SWM', {'weight': 80, 'length_pool': 25}, lap=0.1))
+    assert len(segments) == 3
+    for item in segments:
+        assert item.info.training_type == 'Swimming'
+        assert item.info.speed == pytest.approx(
+            item.info.distance / item.info.duration), (
+            'Скорость плавания по отсчётам должна следовать из дистанции.'
+        )
+
+
+@pytest.mark.parametrize('use_numpy', [True, False])
+@pytest.mark.parametrize('workout_type', ['SWM', 'RUN', 'WLK'])
+def test_BatchExecutor(monkeypatch, use_numpy, workout_type):
+    if not use_numpy:
+        monkeypatch.setattr(homework, 'np', None)
+    fields = homework.get_training_class(workout_type).FIELDS
+    rows = [[1000 + index * 7, 0.5 + index % 5, 60 + index % 30,
+             25 if workout_type == 'SWM' else 150 + index % 50, 40]
+            [:len(fields)] for index in range(1001)]
+    arrays = {name: [row[index] for row in rows]
+              for index, name in enumerate(fields)}
+    expected = homework.compute_batch(workout_type, arrays)
+    with homework.BatchExecutor(threads=4, chunk_size=100) as executor:
+        results = []
+        threads = [threading.Thread(
+            target=lambda: results.append(
+                executor.compute(workout_type, arrays)))
+            for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert len(results) == 3
+    for batch in results:
+        assert batch.training_type == expected.training_type
+        for name in ('duration', 'distance', 'speed', 'calories'):
+            assert list(getattr(batch, name)) == list(
+                getattr(expected, name)), (
+                'Расчёт по потокам должен совпадать с `compute_batch` '
+                'побитно.'
+            )
+
+
+def test_run_binary_threads(tmp_path):
+    packets = tmp_path / 'packets.txt'
+    packets.write_text('RUN,15000,1,75\nSWM,720,1,80,25,40\n'
+                       'RUN,9000,1,75\nWLK,9000,1,75,180\n' * 50,
+                       encoding='utf-8')
+    binary = tmp_path / 'packets.hwpk'
+    homework.run([str(packets), '--to-binary', str(binary)])
+    with Capturing() as expected:
+        homework.run([str(binary), '--binary'])
+    with Capturing() as output:
+        homework.run([str(binary), '--binary', '--threads', '3'])
+    assert output == expected
+
+
+def sort_messages(count, seed=0):
+    rng = random.Random(seed)
+    return [homework.InfoMessage(
+        rng.choice(['Running', 'Swimming', 'SportsWalking']),
+        rng.randint(1, 3), rng.random(), rng.random(),
+        float(rng.randint(0, 50))) for _ in range(count)]
+
+
+@pytest.mark.parametrize('budget', [1 << 20, 3000 * 256, 100 * 256])
+def test_external_sort(monkeypatch, tmp_path, budget):
+    monkeypatch.setattr(homework, 'MERGE_FAN_IN', 4)
+    messages = sort_messages(5000)
+    key = operator.attrgetter('training_type', 'calories')
+    result = list(homework.external_sort(messages, memory_budget=budget,
+                                         directory=str(tmp_path)))
+    assert result == sorted(messages, key=key), (
+        'Внешняя сортировка должна совпадать с устойчивой `sorted`.'
+    )
+    assert list(tmp_path.iterdir()) == [], (
+        'Временные файлы отрезков должны удаляться после слияния.'
+    )
+    assert list(homework.external_sort([], memory_budget=budget)) == []
+
+
+def test_external_group_by():
+    messages = sort_messages(3000, seed=1)
+    groups = list(homework.external_group_by(
+        messages, key=lambda info: (info.training_type, info.calories // 10),
+        memory_budget=200 * 256))
+    keys = [group for group, _ in groups]
+    assert keys == sorted(set(keys))
+    assert sum(totals.workouts for _, totals in groups) == 3000
+    running = [totals for (training_type, _), totals in groups
+               if training_type == 'Running']
+    assert sum(totals.calories for totals in running) == pytest.approx(
+        sum(info.calories for info in messages
+            if info.training_type == 'Running'))
+
+
+def test_run_sort(tmp_path):
+    packets = tmp_path / 'packets.txt'
+    packets.write_text('RUN,15000,1,75\nSWM,720,1,80,25,40\n'
+                       'RUN,9000,1,75\nWLK,9000,1,75,180\n',
+                       encoding='utf-8')
+    with Capturing() as output:
+        homework.run([str(packets), '--sort', '--memory-budget', '1'])
+    assert [line.split(';')[0] for line in output] == [
+        'Тип тренировки: Running', 'Тип тренировки: Running',
+        'Тип тренировки: SportsWalking', 'Тип тренировки: Swimming',
+    ]
+    assert output[0] == homework.read_package(
+        'RUN', [9000, 1, 75]).show_training_info().get_message()
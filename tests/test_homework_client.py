@@ -0,0 +1,59 @@
+import asyncio
+import io
+import threading
+
+import pytest
+
+import homework
+import homework_client
+
+LINES = ['RUN,15000,1,75', '["SWM", [720, 1, 80, 25, 40]]',
+         'SQT,9210,5,85,160', '', 'WLK,9000,1,75,180']
+DATA = ''.join(line + '\n' for line in LINES).encode()
+EXPECTED = ''.join(homework.format_reply(line, False, None) + '\n'
+                   for line in LINES if line)
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    path = str(tmp_path / 'homework.sock')
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(homework.start_server(path=path))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield path
+    loop.call_soon_threadsafe(server.close)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+def test_send(daemon):
+    output = io.BytesIO()
+    homework_client.send(DATA * 200, daemon, output)
+    assert output.getvalue().decode() == EXPECTED * 200, (
+        'Клиент должен печатать ответы демона по порядку пакетов.'
+    )
+
+
+def test_run_without_daemon(tmp_path, capsys):
+    packets = tmp_path / 'packets.csv'
+    packets.write_bytes(DATA)
+    homework_client.run(['--socket', str(tmp_path / 'missing.sock'),
+                         str(packets)])
+    assert capsys.readouterr().out == EXPECTED, (
+        'Без демона клиент должен отвечать так же, как демон.'
+    )
+
+
+def test_run_without_daemon_bad_bytes(tmp_path, capsys):
+    packets = tmp_path / 'packets.csv'
+    packets.write_bytes(b'RUN,15000,1,75\n\xff\xfe\nWLK,9000,1,75,180\n')
+    homework_client.run(['--socket', str(tmp_path / 'missing.sock'),
+                         str(packets)])
+    output = capsys.readouterr().out.splitlines()
+    assert output[1].startswith('Ошибка: UnicodeDecodeError'), (
+        'Без демона плохая строка должна получать ответ с ошибкой.'
+    )
+    expected = EXPECTED.splitlines()
+    assert output[::2] == [expected[0], expected[3]]